@@ -10,7 +10,9 @@ from core.api_client import BACKEND_BASE_URL
 #import streamlit as st
 
 # from core.api_client import backend_ping, backend_db_ping
-from core.db import init_db
+from core.db import ensure_schema
+from core.blob_gc import start_blob_gc
+from core.sweeper import start_reservation_sweeper
 from core.auth import ensure_user_logged_in
 from pag import home, create_listing, my_listings, admin_dashboard, profile, cart, checkout
 # from pag import test_strip_connect  # optional test page – keep commented for now
@@ -28,9 +30,14 @@ BASE_NAV_PAGES = [
 ## temp changed
 
 def main():
-    # 1) Init DB + page config
+    # 1) Init DB (once per process) + page config
     import streamlit as st
-    init_db()
+    ensure_schema()
+    # Release listings from expired (unpaid) Stripe checkouts; needs
+    # STRIPE_SECRET_KEY, no-op if unset or already running
+    start_reservation_sweeper()
+    # Delete upload blobs nothing references any more
+    start_blob_gc()
     st.set_page_config(page_title="Circle Marketplace", layout="wide")
 
     # # 2) Backend status indicators in sidebar
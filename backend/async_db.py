@@ -0,0 +1,580 @@
+# backend/async_db.py
+"""
+Async access to the backend DB for the FastAPI routes in backend/main.py.
+
+All DB work runs on a small pool of dedicated threads, each owning one
+connection, and routes simply `await` it. The event loop never blocks on
+sqlite3 / psycopg2 and never borrows Uvicorn's request threadpool. A
+connection the server dropped is replaced on its thread, and an operation
+that failed on it before committing is retried once on the new one.
+
+The driver is pluggable:
+  - SQLite (default): backend.db.DB_PATH (circle.db), tuned via core.sqlite_config
+  - Postgres: set CIRCLE_DATABASE_URL=postgresql://... (needs psycopg2)
+
+Routes pass a per-request DBSession (backend.main's db_session
+dependency) to the functions below; it counts the statements a request
+runs so N+1 patterns show up in the X-Query-Count header and hit a cap.
+
+Queries are written once with "?" placeholders and INSERT ... RETURNING id,
+which both backends understand (the Postgres driver rewrites "?" to "%s").
+"""
+import asyncio
+import os
+import logging
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from backend import db as sync_db
+from backend.notifications import valid_email_address
+from backend.outbox import ensure_outbox_table, outbox_counts
+from core.sqlite_config import connect as sqlite_connect
+
+# Try to import psycopg2, but don't crash if only SQLite is used
+try:
+    import psycopg2  # type: ignore
+    import psycopg2.extras  # type: ignore
+except ImportError:
+    psycopg2 = None
+
+log = logging.getLogger(__name__)
+
+DATABASE_URL = os.getenv("CIRCLE_DATABASE_URL", "")
+
+# DB threads (= connections) per process; empty means the driver's default
+DB_POOL_SIZE = os.getenv("CIRCLE_BACKEND_DB_POOL_SIZE", "")
+
+
+# ---------- DRIVERS ----------
+
+
+class SQLiteDriver:
+    name = "sqlite"
+    id_column = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    # One writer at a time anyway, and queries are sub-millisecond; more
+    # threads would only trade the queue for busy_timeout waits
+    pool_size = 1
+    disconnect_errors = (sqlite3.OperationalError, sqlite3.InterfaceError, sqlite3.ProgrammingError)
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def connect(self):
+        return sqlite_connect(self.db_path)
+
+    def is_closed(self, conn) -> bool:
+        try:
+            conn.total_changes
+        except sqlite3.ProgrammingError:
+            return True
+        return False
+
+    def sql(self, query: str) -> str:
+        return query
+
+
+class PostgresDriver:
+    name = "postgres"
+    id_column = "SERIAL PRIMARY KEY"
+
+    pool_size = 4
+
+    _PLACEHOLDER_RE = re.compile(r"\?")
+
+    def __init__(self, dsn: str):
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 is not installed; cannot use a Postgres DATABASE_URL")
+        self.dsn = dsn
+        self.disconnect_errors = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+    def connect(self):
+        return psycopg2.connect(self.dsn, cursor_factory=psycopg2.extras.RealDictCursor)
+
+    def is_closed(self, conn) -> bool:
+        # psycopg2 sets .closed once it notices the server went away
+        return bool(conn.closed)
+
+    def sql(self, query: str) -> str:
+        return self._PLACEHOLDER_RE.sub("%s", query)
+
+
+def make_driver(url: str = None):
+    url = DATABASE_URL if url is None else url
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresDriver(url)
+    return SQLiteDriver(url or sync_db.DB_PATH)
+
+
+# ---------- ASYNC DB ----------
+
+
+class _QueryMethods:
+    """fetchone / fetchall / execute / insert on top of self.run(fn)."""
+
+    async def fetchone(self, query: str, params=()):
+        def op(conn):
+            cur = conn.cursor()
+            cur.execute(self.driver.sql(query), params)
+            return cur.fetchone()
+
+        return await self.run(op)
+
+    async def fetchall(self, query: str, params=()):
+        def op(conn):
+            cur = conn.cursor()
+            cur.execute(self.driver.sql(query), params)
+            return cur.fetchall()
+
+        return await self.run(op)
+
+    async def execute(self, query: str, params=()) -> int:
+        """Run a write; returns the affected row count."""
+        def op(conn):
+            cur = conn.cursor()
+            cur.execute(self.driver.sql(query), params)
+            return cur.rowcount
+
+        return await self.run(op)
+
+    async def insert(self, query: str, params=()) -> int:
+        """Run an INSERT ... RETURNING id and return the new id."""
+        def op(conn):
+            cur = conn.cursor()
+            cur.execute(self.driver.sql(query), params)
+            # Drain the RETURNING rows so the statement is done before commit
+            return cur.fetchall()[0]["id"]
+
+        return await self.run(op)
+
+
+class AsyncDB(_QueryMethods):
+    """A few DB threads, one connection each; await their results."""
+
+    def __init__(self, driver, pool_size: Optional[int] = None):
+        self.driver = driver
+        if pool_size is None:
+            pool_size = int(DB_POOL_SIZE) if DB_POOL_SIZE else driver.pool_size
+        self.pool_size = max(1, pool_size)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.pool_size, thread_name_prefix="backend-db"
+        )
+        self._local = threading.local()
+        # Every open connection, so close() can reach all threads' ones
+        self._conns = set()
+        self._conns_lock = threading.Lock()
+        self.reconnects = 0
+
+    def _connection(self):
+        # Only ever called on a DB thread; each thread keeps its own
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self.driver.is_closed(conn):
+            self._discard(conn)
+            conn = None
+        if conn is None:
+            conn = self.driver.connect()
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.add(conn)
+        return conn
+
+    def _discard(self, conn):
+        self._local.conn = None
+        with self._conns_lock:
+            self._conns.discard(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _run_sync(self, fn):
+        for attempt in (1, 2):
+            conn = self._connection()
+            try:
+                result = fn(conn)
+            except self.driver.disconnect_errors as e:
+                if not self.driver.is_closed(conn):
+                    conn.rollback()
+                    raise
+                # Dropped before commit, so nothing was written: retry once
+                self._discard(conn)
+                self.reconnects += 1
+                if attempt == 2:
+                    raise
+                log.warning("Backend DB connection lost (%s); reconnecting", e)
+                continue
+            except BaseException:
+                conn.rollback()
+                raise
+            try:
+                conn.commit()
+            except BaseException:
+                # Not retried: the commit may have landed before the drop
+                if self.driver.is_closed(conn):
+                    self._discard(conn)
+                    self.reconnects += 1
+                else:
+                    conn.rollback()
+                raise
+            return result
+
+    async def run(self, fn):
+        """Run fn(conn) on a DB thread in its own transaction."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run_sync, fn)
+
+    async def close(self):
+        # Let queued work finish, then close every thread's connection
+        await asyncio.to_thread(self._executor.shutdown, True)
+        with self._conns_lock:
+            conns, self._conns = self._conns, set()
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+# ---------- REQUEST SESSIONS ----------
+
+# Statements one request may issue before it is failed; 0 disables the cap
+MAX_QUERIES_PER_REQUEST = int(os.getenv("CIRCLE_MAX_QUERIES_PER_REQUEST", "50"))
+
+
+class QueryLimitExceeded(RuntimeError):
+    """
+    A request ran more statements than its DBSession allows.
+
+    Raised inside the operation that crossed the cap, so only that
+    operation is rolled back. Every session call commits on its own:
+    whatever the request wrote in earlier calls stays committed.
+    """
+
+
+class _CountingCursor:
+    def __init__(self, cursor, session):
+        self._cursor = cursor
+        self._session = session
+
+    def execute(self, query, params=()):
+        self._session._count(query)
+        self._cursor.execute(query, params)
+        return self
+
+    def executemany(self, query, seq):
+        # One batch, one round trip: counts once
+        self._session._count(query)
+        self._cursor.executemany(query, seq)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _CountingConnection:
+    def __init__(self, conn, session):
+        self._conn = conn
+        self._session = session
+
+    def cursor(self):
+        return _CountingCursor(self._conn.cursor(), self._session)
+
+    def execute(self, query, params=()):
+        return self.cursor().execute(query, params)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class DBSession(_QueryMethods):
+    """
+    One request's handle on the shared AsyncDB pool (see
+    backend.main's db_session dependency). Same API as AsyncDB, but every
+    statement is counted, and once a request passes max_queries it fails
+    with QueryLimitExceeded instead of quietly running an N+1 loop.
+    """
+
+    def __init__(self, adb: Optional[AsyncDB] = None, max_queries: int = MAX_QUERIES_PER_REQUEST):
+        self._adb = adb
+        self.max_queries = max_queries
+        self.queries = 0
+
+    @property
+    def adb(self) -> AsyncDB:
+        if self._adb is None:
+            self._adb = get_db()
+        return self._adb
+
+    @property
+    def driver(self):
+        return self.adb.driver
+
+    def _count(self, query: str):
+        # Runs on a DB thread; the awaiting request is suspended meanwhile
+        self.queries += 1
+        if self.max_queries and self.queries > self.max_queries:
+            raise QueryLimitExceeded(
+                f"more than {self.max_queries} queries in one request "
+                f"(last: {' '.join(query.split())[:80]})"
+            )
+
+    async def run(self, fn):
+        return await self.adb.run(lambda conn: fn(_CountingConnection(conn, self)))
+
+
+def _target(session: Optional[DBSession]):
+    """The request's session if we got one, else the shared AsyncDB."""
+    return session if session is not None else get_db()
+
+
+_db: Optional[AsyncDB] = None
+
+
+def get_db() -> AsyncDB:
+    global _db
+    if _db is None:
+        _db = AsyncDB(make_driver())
+    return _db
+
+
+async def close_db():
+    global _db
+    if _db is not None:
+        await _db.close()
+        _db = None
+
+
+# ---------- SCHEMA ----------
+
+
+# Tables the routes query through the driver
+SCHEMA_TABLES = ("users", "invites")
+
+
+async def ensure_schema():
+    """
+    Create the backend tables if they don't exist yet. Called once from
+    backend.main's lifespan hook; no request path runs DDL. This and
+    backend.outbox.ensure_outbox_table are the only backend DDL.
+    """
+    adb = get_db()
+    id_column = adb.driver.id_column
+    await adb.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS users (
+            id {id_column},
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            full_name TEXT,
+            is_verified INTEGER NOT NULL DEFAULT 0,
+            invited_by_id INTEGER,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    await adb.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS invites (
+            id {id_column},
+            email TEXT NOT NULL,
+            invited_by_id INTEGER,
+            used_by_user_id INTEGER,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            used_at TEXT
+        )
+        """
+    )
+    await adb.execute("CREATE INDEX IF NOT EXISTS idx_invites_email ON invites(email)")
+    # The mail outbox always lives in the local SQLite file
+    await asyncio.to_thread(ensure_outbox_table)
+
+
+async def missing_tables() -> list:
+    """Backend tables that cannot be queried (yet); [] means ready."""
+    adb = get_db()
+    missing = []
+    for table in SCHEMA_TABLES:
+        try:
+            await adb.fetchall(f"SELECT 1 FROM {table} LIMIT 0")
+        except Exception:  # sqlite3 / psycopg2 errors alike
+            missing.append(table)
+    try:
+        await asyncio.to_thread(outbox_counts)
+    except sqlite3.Error:
+        missing.append("email_outbox")
+    return missing
+
+
+# ---------- USERS ----------
+
+
+async def get_users_count(session: Optional[DBSession] = None) -> int:
+    row = await _target(session).fetchone("SELECT COUNT(*) AS count FROM users")
+    return row["count"]
+
+
+async def get_user_by_email(email: str, session: Optional[DBSession] = None):
+    return await _target(session).fetchone("SELECT * FROM users WHERE email = ?", (email,))
+
+
+async def create_user(
+    email: str,
+    password: str,
+    full_name: Optional[str] = None,
+    session: Optional[DBSession] = None,
+) -> int:
+    return await _target(session).insert(
+        """
+        INSERT INTO users (email, password_hash, full_name, is_verified)
+        VALUES (?, ?, ?, 1)
+        RETURNING id
+        """,
+        (email, sync_db.hash_password(password), full_name),
+    )
+
+
+# ---------- INVITES ----------
+
+
+async def create_invite(
+    email: str,
+    invited_by_id: Optional[int] = None,
+    session: Optional[DBSession] = None,
+) -> int:
+    return await _target(session).insert(
+        """
+        INSERT INTO invites (email, invited_by_id)
+        VALUES (?, ?)
+        RETURNING id
+        """,
+        (email.lower().strip(), invited_by_id),
+    )
+
+
+# SQLite's default bound-variable limit is 999; stay well under it
+_IN_CHUNK = 500
+
+
+async def create_invites_bulk(
+    rows,
+    invited_by_id: Optional[int] = None,
+    session: Optional[DBSession] = None,
+) -> list:
+    """
+    Invite many (email, name) pairs in one transaction.
+
+    Emails already holding an unused invite, or repeated earlier in `rows`,
+    are skipped. Returns one dict per input row, in order:
+    {row, email, name, status, invite_id}, where status is "invited",
+    "already_invited", "duplicate" or "invalid".
+    """
+    results = []
+    fresh = {}  # email -> result, first occurrence only
+    for i, (email, name) in enumerate(rows):
+        email = (email or "").strip().lower()
+        result = {
+            "row": i,
+            "email": email,
+            "name": (name or "").strip(),
+            "status": "invited",
+            "invite_id": None,
+        }
+        if not valid_email_address(email):
+            result["status"] = "invalid"
+        elif email in fresh:
+            result["status"] = "duplicate"
+        else:
+            fresh[email] = result
+        results.append(result)
+
+    adb = _target(session)
+
+    def _lookup(cur, emails) -> dict:
+        found = {}
+        for start in range(0, len(emails), _IN_CHUNK):
+            chunk = emails[start:start + _IN_CHUNK]
+            cur.execute(
+                adb.driver.sql(
+                    f"""
+                    SELECT id, email FROM invites
+                    WHERE used_by_user_id IS NULL
+                      AND email IN ({",".join("?" * len(chunk))})
+                    ORDER BY id
+                    """
+                ),
+                chunk,
+            )
+            # Newest unused invite wins, like get_invite_for_email
+            found.update((r["email"], r["id"]) for r in cur.fetchall())
+        return found
+
+    def op(conn):
+        cur = conn.cursor()
+        existing = _lookup(cur, list(fresh))
+        for email, invite_id in existing.items():
+            fresh[email]["status"] = "already_invited"
+            fresh[email]["invite_id"] = invite_id
+
+        new_emails = [e for e in fresh if e not in existing]
+        if not new_emails:
+            return
+        cur.executemany(
+            adb.driver.sql("INSERT INTO invites (email, invited_by_id) VALUES (?, ?)"),
+            [(email, invited_by_id) for email in new_emails],
+        )
+        # None of these had an unused invite before, so whatever is there
+        # now is what we just inserted (same transaction, same thread)
+        for email, invite_id in _lookup(cur, new_emails).items():
+            fresh[email]["invite_id"] = invite_id
+
+    await adb.run(op)
+    return results
+
+
+async def get_invite_for_email(email: str, session: Optional[DBSession] = None):
+    """Return an unused invite row for this email, or None."""
+    return await _target(session).fetchone(
+        """
+        SELECT * FROM invites
+        WHERE email = ? AND used_by_user_id IS NULL
+        ORDER BY id DESC
+        LIMIT 1
+        """,
+        (email.lower().strip(),),
+    )
+
+
+async def mark_invite_used(invite_id: int, user_id: int, session: Optional[DBSession] = None):
+    await _target(session).execute(
+        """
+        UPDATE invites
+        SET used_by_user_id = ?, used_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        """,
+        (user_id, invite_id),
+    )
+
+
+async def get_invites(invited_by_id: Optional[int] = None, session: Optional[DBSession] = None):
+    """All invites, newest first; optionally only those from one inviter."""
+    where = ""
+    params = ()
+    if invited_by_id is not None:
+        where = "WHERE invited_by_id = ?"
+        params = (invited_by_id,)
+    return await _target(session).fetchall(
+        f"""
+        SELECT id, email, invited_by_id, used_by_user_id, created_at, used_at
+        FROM invites
+        {where}
+        ORDER BY id DESC
+        """,
+        params,
+    )
+
@@ -0,0 +1,48 @@
+# backend/email_templates.py
+"""
+Outgoing email texts, compiled once at import as string.Template so
+sending an invite (or 200 of them) is a cheap substitute() call.
+"""
+from string import Template
+
+INVITE_SUBJECT = "Your Invitation to Circle — A Curated Community of Trusted Sellers"
+
+INVITE_BODY = Template(
+    """Hello $greeting_name,
+
+A Circle member has extended a private invitation on your behalf.
+Membership is granted only when an existing member is willing to stand behind your character and your integrity.
+
+Circle is a curated environment for selling and discovering:
+vintage pieces, designer goods, artwork, craftwork, and unique personal items — always authentic, never counterfeit.
+
+Our community is built on three principles:
+
+Trust. Taste. Transparency.
+
+Every invitation represents a personal recommendation.
+Every member is responsible for the integrity of the people they invite.
+
+If you choose to join, you are affirming that you will uphold the same standards:
+authenticity, honesty, and respect in every transaction.
+
+Our guidelines:
+
+• List only authentic and original items
+• Conduct all transactions with honesty and professionalism
+• Invite only individuals you personally trust and would vouch for
+• Sellers contribute a 10% commission that supports Circle’s operations and curation
+
+Your invitation is now active.
+Use this email address to join the Circle.
+
+Warmly,
+Jo BoBa
+Founder, Circle
+"""
+)
+
+
+def render_invite(name: str = "") -> tuple:
+    """(subject, body) for an invitation; name may be empty."""
+    return INVITE_SUBJECT, INVITE_BODY.substitute(greeting_name=name or "there")
@@ -1,25 +1,67 @@
 # backend/main.py
-from fastapi import FastAPI, HTTPException
+import asyncio
+import csv
+import io
+import traceback
+from contextlib import asynccontextmanager
+
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import Optional
-from .paypal_client import create_paypal_order
-
-from backend.db import (
+from typing import List, Optional
+from .paypal_client import create_paypal_order, get_paypal_client
+
+from backend.db import verify_password
+from backend.async_db import (
+    DBSession,
+    QueryLimitExceeded,
+    close_db,
+    ensure_schema,
+    missing_tables,
     get_users_count,
     create_user,
     get_user_by_email,
-    verify_password,
     create_invite,
+    create_invites_bulk,
     get_invite_for_email,
     mark_invite_used,
-    get_invites_by_inviter,
-
+    get_invites,
 )
 
-from backend.notifications import send_email
+from backend.email_templates import render_invite
+from backend.notifications import valid_email_address
+from backend.outbox import enqueue_email, enqueue_emails, start_mail_worker, stop_mail_worker
+from backend.db import DB_PATH
+from core.sqlite_config import start_checkpoint_scheduler, wal_size_bytes
+
+# Set by the lifespan hook; reported by /ready
+_schema_state = {"ready": False, "error": None}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Periodically checkpoint circle.db's WAL so it doesn't grow unbounded
+    start_checkpoint_scheduler(DB_PATH)
+    # Create tables once here so request handlers only run their queries.
+    # A failure keeps the process up (so /ready can say why) but not ready.
+    try:
+        await ensure_schema()
+        _schema_state.update(ready=True, error=None)
+    except Exception as e:
+        print("Schema bootstrap failed:", e)
+        traceback.print_exc()
+        _schema_state.update(ready=False, error=str(e))
+    # Background sender for the durable email outbox
+    await asyncio.to_thread(start_mail_worker)
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(stop_mail_worker)
+        await close_db()
+
 
-app = FastAPI(title="Circle Backend")
+app = FastAPI(title="Circle Backend", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,30 +72,31 @@ app.add_middleware(
 )
 
 
-from backend.db import get_connection  # you already import this below in /invites
+@app.middleware("http")
+async def count_queries(request: Request, call_next):
+    # One DBSession per request; handlers get it through db_session()
+    session = DBSession()
+    request.state.db_session = session
+    response = await call_next(request)
+    response.headers["X-Query-Count"] = str(session.queries)
+    return response
+
+
+def db_session(request: Request) -> DBSession:
+    """Dependency: this request's DB session (see count_queries)."""
+    return request.state.db_session
+
+
+@app.exception_handler(QueryLimitExceeded)
+async def query_limit_exceeded(request: Request, exc: QueryLimitExceeded):
+    # Only the capped operation was rolled back; earlier calls committed
+    print(f"Query cap hit on {request.method} {request.url.path}: {exc}")
+    return JSONResponse(status_code=500, content={"detail": "Too many database queries."})
+
 
 @app.get("/invites/by_inviter/{invited_by_id}")
-def invites_by_inviter(invited_by_id: int):
-    from backend.db import get_connection
-
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id,
-               email,
-               invited_by_id,
-               used_by_user_id,
-               created_at,
-               used_at
-        FROM invites
-        WHERE invited_by_id = ?
-        ORDER BY id DESC
-        """,
-        (invited_by_id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+async def invites_by_inviter(invited_by_id: int, session: DBSession = Depends(db_session)):
+    rows = await get_invites(invited_by_id, session=session)
 
     return {
         "status": "ok",
@@ -62,19 +105,44 @@ def invites_by_inviter(invited_by_id: int):
 
 
 @app.get("/ping")
-def ping():
+async def ping():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 200 once the startup schema bootstrap succeeded and
+    every backend table is queryable, 503 otherwise.
+    """
+    missing = await missing_tables()
+    is_ready = _schema_state["ready"] and not missing
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={
+            "status": "ready" if is_ready else "not_ready",
+            "schema": {
+                "bootstrapped": _schema_state["ready"],
+                "missing_tables": missing,
+                "error": _schema_state["error"],
+            },
+        },
+    )
+
+
 @app.get("/db/ping")
-def db_ping():
+async def db_ping(session: DBSession = Depends(db_session)):
     """
     Test that the backend can talk to Supabase Postgres.
     Returns users_count so we know queries are working.
     """
     try:
-        count = get_users_count()
-        return {"status": "ok", "users_count": count}
+        count = await get_users_count(session=session)
+        return {
+            "status": "ok",
+            "users_count": count,
+            "wal_bytes": wal_size_bytes(DB_PATH),
+        }
     except Exception as e:
         # TEMP: show full error detail so we can debug
         print("DB error:", e)
@@ -84,7 +152,6 @@ def db_ping():
 
 
 from pydantic import BaseModel
-from backend.db import create_user, get_user_by_email
 
 class RegisterRequest(BaseModel):
     email: str
@@ -102,66 +169,94 @@ class InviteCreateRequest(BaseModel):
 
 
 @app.post("/invites/create")
-def invites_create(payload: InviteCreateRequest):
+async def invites_create(payload: InviteCreateRequest, session: DBSession = Depends(db_session)):
     email = payload.email.strip().lower()
     name = (payload.name or "").strip()
     invited_by_id = payload.invited_by_id
 
     if not email:
         raise HTTPException(status_code=400, detail="Email is required.")
+    if not valid_email_address(email):
+        raise HTTPException(status_code=400, detail="Invalid email address.")
+
+    invite_id = await create_invite(email=email, invited_by_id=invited_by_id, session=session)
 
-    invite_id = create_invite(email=email, invited_by_id=invited_by_id)
+    subject, body = render_invite(name)
 
-    greeting_name = name if name else "there"
+    # Queued durably; the outbox worker does the SMTP part
+    await asyncio.to_thread(enqueue_email, email, subject, body)
 
-    subject = "Your Invitation to Circle — A Curated Community of Trusted Sellers"
+    return {"status": "ok", "invite_id": invite_id}
 
-    body = f"""Hello {greeting_name},
 
-A Circle member has extended a private invitation on your behalf.
-Membership is granted only when an existing member is willing to stand behind your character and your integrity.
+# Largest cohort a single /invites/bulk call may carry
+MAX_BULK_INVITES = 1000
 
-Circle is a curated environment for selling and discovering:
-vintage pieces, designer goods, artwork, craftwork, and unique personal items — always authentic, never counterfeit.
 
-Our community is built on three principles:
+class InviteBulkItem(BaseModel):
+    email: str
+    name: Optional[str] = None
 
-Trust. Taste. Transparency.
 
-Every invitation represents a personal recommendation.
-Every member is responsible for the integrity of the people they invite.
+class InviteBulkRequest(BaseModel):
+    invites: List[InviteBulkItem] = []
+    # Alternatively "email,name" lines (a header row is optional)
+    csv: Optional[str] = None
+    invited_by_id: Optional[int] = None
 
-If you choose to join, you are affirming that you will uphold the same standards:
-authenticity, honesty, and respect in every transaction.
 
-Our guidelines:
+def _parse_invite_csv(text: str) -> list:
+    rows = []
+    for record in csv.reader(io.StringIO(text)):
+        if not record or not record[0].strip():
+            continue
+        if not rows and record[0].strip().lower() == "email":
+            continue  # header
+        rows.append((record[0], record[1] if len(record) > 1 else ""))
+    return rows
 
-• List only authentic and original items
-• Conduct all transactions with honesty and professionalism
-• Invite only individuals you personally trust and would vouch for
-• Sellers contribute a 10% commission that supports Circle’s operations and curation
 
-Your invitation is now active.
-Use this email address to join the Circle.
+@app.post("/invites/bulk")
+async def invites_bulk(payload: InviteBulkRequest, session: DBSession = Depends(db_session)):
+    """
+    Invite a whole cohort at once: one DB transaction for the inserts and
+    one outbox transaction for the emails. Returns a result per input row.
+    """
+    rows = [(item.email, item.name) for item in payload.invites]
+    if payload.csv:
+        rows.extend(_parse_invite_csv(payload.csv))
 
-Warmly,
-Jo BoBa
-Founder, Circle
-"""
-    send_email(email, subject, body)
+    if not rows:
+        raise HTTPException(status_code=400, detail="No invites given.")
+    if len(rows) > MAX_BULK_INVITES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BULK_INVITES} invites per request.",
+        )
 
-    return {"status": "ok", "invite_id": invite_id}
+    results = await create_invites_bulk(
+        rows, invited_by_id=payload.invited_by_id, session=session
+    )
+
+    invited = [r for r in results if r["status"] == "invited"]
+    messages = []
+    for r in invited:
+        subject, body = render_invite(r["name"])
+        messages.append((r["email"], subject, body))
+    await asyncio.to_thread(enqueue_emails, messages)
+
+    return {"status": "ok", "created": len(invited), "results": results}
 
 
 @app.post("/auth/login")
-def login(payload: LoginRequest):
+async def login(payload: LoginRequest, session: DBSession = Depends(db_session)):
     email = payload.email.strip().lower()
     password = payload.password.strip()
 
     if not email or not password:
         raise HTTPException(status_code=400, detail="Email and password are required.")
 
-    user = get_user_by_email(email)
+    user = await get_user_by_email(email, session=session)
     if not user:
         # don't reveal which part is wrong
         raise HTTPException(status_code=401, detail="Invalid email or password.")
@@ -181,20 +276,8 @@ def login(payload: LoginRequest):
 
 
 @app.get("/invites")
-def invites_list():
-    from backend.db import get_connection
-
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, email, invited_by_id, used_by_user_id, created_at, used_at
-        FROM invites
-        ORDER BY id DESC
-        """
-    )
-    rows = cur.fetchall()
-    conn.close()
+async def invites_list(session: DBSession = Depends(db_session)):
+    rows = await get_invites(session=session)
 
     return {
         "status": "ok",
@@ -204,17 +287,19 @@ def invites_list():
 
 
 @app.post("/auth/register")
-def register(payload: RegisterRequest):
+async def register(payload: RegisterRequest, session: DBSession = Depends(db_session)):
     email = payload.email.strip().lower()
     password = payload.password.strip()
 
     # 1) Check if email already exists
-    existing = get_user_by_email(email)
+    existing = await get_user_by_email(email, session=session)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered.")
 
     # 2) Create the user
-    user_id = create_user(email=email, password=password, full_name=payload.full_name)
+    user_id = await create_user(
+        email=email, password=password, full_name=payload.full_name, session=session
+    )
     return {"status": "ok", "user_id": user_id}
 
     # 5) send welcome email (console)
@@ -225,20 +310,14 @@ def register(payload: RegisterRequest):
         "You can now log in, create listings, and shop from curated closets.\n\n"
         "Love,\nCircle"
     )
-    send_email(email, subject, body)
+    await asyncio.to_thread(enqueue_email, email, subject, body)
 
     return {"status": "ok", "user_id": user_id}
 
 
-from backend.db import (
-    get_users_count,
-    create_user,
-    get_user_by_email,
-    verify_password,
-)
 
 @app.post("/auth/register")
-def register(payload: RegisterRequest):
+async def register(payload: RegisterRequest, session: DBSession = Depends(db_session)):
     email = payload.email.strip().lower()
     password = payload.password.strip()
     full_name = payload.full_name.strip() if payload.full_name else None
@@ -247,12 +326,12 @@ def register(payload: RegisterRequest):
         raise HTTPException(status_code=400, detail="Email and password are required.")
 
     # 1) already registered?
-    existing = get_user_by_email(email)
+    existing = await get_user_by_email(email, session=session)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered.")
 
     # 2) invite-only: require an unused invite for this email
-    invite = get_invite_for_email(email)
+    invite = await get_invite_for_email(email, session=session)
     if not invite:
         raise HTTPException(
             status_code=403,
@@ -260,10 +339,12 @@ def register(payload: RegisterRequest):
         )
 
     # 3) create user
-    user_id = create_user(email=email, password=password, full_name=full_name)
+    user_id = await create_user(
+        email=email, password=password, full_name=full_name, session=session
+    )
 
     # 4) mark invite as used
-    mark_invite_used(invite["id"], user_id)
+    await mark_invite_used(invite["id"], user_id, session=session)
 
     return {"status": "ok", "user_id": user_id}
 
@@ -275,7 +356,7 @@ class RegisterRequest(BaseModel):
 
 
 @app.post("/auth/register")
-def register(payload: RegisterRequest):
+async def register(payload: RegisterRequest, session: DBSession = Depends(db_session)):
     email = payload.email.strip().lower()
     password = payload.password.strip()
     full_name = payload.full_name.strip() if payload.full_name else None
@@ -284,12 +365,14 @@ def register(payload: RegisterRequest):
         raise HTTPException(status_code=400, detail="Email and password are required.")
 
     # 1) Check if email already exists
-    existing = get_user_by_email(email)
+    existing = await get_user_by_email(email, session=session)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered.")
 
     # 2) Create the user
-    user_id = create_user(email=email, password=password, full_name=full_name)
+    user_id = await create_user(
+        email=email, password=password, full_name=full_name, session=session
+    )
     return {"status": "ok", "user_id": user_id}
 class PayPalCreateOrderRequest(BaseModel):
     total_amount: float
@@ -297,14 +380,14 @@ class PayPalCreateOrderRequest(BaseModel):
 
 
 @app.post("/payments/paypal/create-order")
-def paypal_create_order(req: PayPalCreateOrderRequest):
+async def paypal_create_order(req: PayPalCreateOrderRequest):
     """
     Create a PayPal order for the given amount and return the approval URL.
     """
     try:
         # Format as string like "10.00"
         amount_str = f"{req.total_amount:.2f}"
-        order = create_paypal_order(amount_str, currency=req.currency)
+        order = await asyncio.to_thread(create_paypal_order, amount_str, currency=req.currency)
         if not order.get("approval_url"):
             raise HTTPException(status_code=500, detail="No approval URL from PayPal")
         return {
@@ -317,3 +400,8 @@ def paypal_create_order(req: PayPalCreateOrderRequest):
         # For now, just bubble up basic message; we can improve later
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.get("/payments/paypal/metrics")
+async def paypal_metrics():
+    """Latency / error counts per PayPal endpoint since startup."""
+    return {"status": "ok", "endpoints": get_paypal_client().stats()}
@@ -2,33 +2,132 @@
 import os
 import smtplib
 import ssl
+import time
 from email.message import EmailMessage
 
 # --- SMTP configuration ---
-SMTP_HOST = "smtp.gmail.com"
-SMTP_PORT = 587
+SMTP_HOST = os.environ.get("CIRCLE_SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("CIRCLE_SMTP_PORT", "587"))
+# Set to "0" for a local relay / test server without TLS
+SMTP_STARTTLS = os.environ.get("CIRCLE_SMTP_STARTTLS", "1") != "0"
 
 SMTP_USER = os.environ.get("CIRCLE_SMTP_USER")      # e.g. jo@circlemarketplace.club
 SMTP_PASSWORD = os.environ.get("CIRCLE_SMTP_PASS")  # app password
 
-FROM_EMAIL = SMTP_USER
+FROM_EMAIL = SMTP_USER or os.environ.get("CIRCLE_FROM_EMAIL", "no-reply@localhost")
 FROM_NAME = "Circle"
 
 
-def send_email(to_email: str, subject: str, body: str):
+def smtp_configured() -> bool:
+    """Credentials are set, or we were pointed at an explicit (local) relay."""
+    return bool(SMTP_USER and SMTP_PASSWORD) or "CIRCLE_SMTP_HOST" in os.environ
+
+
+def valid_email_address(address: str) -> bool:
     """
-    Send a UTF-8 plain-text email via Gmail SMTP with TLS.
+    Loose sanity check for a recipient: one "@", something on both sides,
+    no whitespace or control characters (which would break the To: header).
     """
-    if not SMTP_USER or not SMTP_PASSWORD:
-        print("❌ SMTP is not configured (CIRCLE_SMTP_USER / CIRCLE_SMTP_PASS missing).")
-        return
+    if not address or any(c.isspace() or ord(c) < 32 or ord(c) == 127 for c in address):
+        return False
+    local, at, domain = address.rpartition("@")
+    return bool(at and local and domain)
 
-    # Build a proper email message with UTF-8
+
+def build_message(to_email: str, subject: str, body: str) -> EmailMessage:
+    """A UTF-8 plain-text message from Circle."""
     msg = EmailMessage()
     msg["From"] = f"{FROM_NAME} <{FROM_EMAIL}>"
     msg["To"] = to_email
     msg["Subject"] = subject
     msg.set_content(body, subtype="plain", charset="utf-8")
+    return msg
+
+
+class SMTPConnection:
+    """
+    One long-lived, authenticated SMTP session (STARTTLS + login happen
+    once, not per message). Reconnects transparently when the server has
+    dropped an idle connection.
+    """
+
+    # Servers drop idle sessions; check with NOOP before reusing one this old
+    IDLE_CHECK_SECONDS = 30.0
+
+    def __init__(
+        self,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        user: str = SMTP_USER,
+        password: str = SMTP_PASSWORD,
+        starttls: bool = SMTP_STARTTLS,
+        timeout: float = 30.0,
+    ):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._server = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls(context=ssl.create_default_context())
+        if self.user and self.password:
+            server.login(self.user, self.password)
+        self._server = server
+        self.connects += 1
+
+    def _alive(self) -> bool:
+        if self._server is None:
+            return False
+        if time.monotonic() - self._last_used < self.IDLE_CHECK_SECONDS:
+            return True
+        try:
+            return self._server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def send(self, msg: EmailMessage):
+        if not self._alive():
+            self.close()
+            self._connect()
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # Dropped between the check and the send: one fresh try
+            self.close()
+            self._connect()
+            self._server.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+def send_email(to_email: str, subject: str, body: str):
+    """
+    Send a UTF-8 plain-text email via Gmail SMTP with TLS.
+    Synchronous, one connection per call – request handlers should use
+    backend.outbox.enqueue_email instead.
+    """
+    if not smtp_configured():
+        print("❌ SMTP is not configured (CIRCLE_SMTP_USER / CIRCLE_SMTP_PASS missing).")
+        return
+
+    # Build a proper email message with UTF-8
+    msg = build_message(to_email, subject, body)
 
     print("=== EMAIL OUT (attempting real send) ===")
     print(f"From: {msg['From']}")
@@ -36,10 +135,10 @@ def send_email(to_email: str, subject: str, body: str):
     print(f"Subject: {msg['Subject']}")
     print("=== END EMAIL HEADER ===")
 
-    context = ssl.create_default_context()
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-        server.starttls(context=context)
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        server.send_message(msg)
+    conn = SMTPConnection()
+    try:
+        conn.send(msg)
+    finally:
+        conn.close()
 
     print("✅ Email sent successfully.")
@@ -0,0 +1,280 @@
+# backend/outbox.py
+"""
+Durable outbound email queue.
+
+Request handlers call enqueue_email() (one small SQLite insert) and
+return; a background MailWorker drains the email_outbox table over a
+single persistent SMTP connection (backend.notifications.SMTPConnection).
+
+- Mail survives restarts: it is only marked 'sent' after the SMTP
+  server accepted it.
+- Claiming a batch pushes next_attempt_at forward by a lease, so a
+  worker that dies mid-batch just has its mail picked up again later.
+- Failures are retried with exponential backoff, and given up on
+  ('failed') after MAX_ATTEMPTS.
+"""
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from backend import db as backend_db
+from backend.notifications import (
+    SMTPConnection,
+    build_message,
+    smtp_configured,
+    valid_email_address,
+)
+from core.periodic import PeriodicWorker
+from core.sqlite_config import connect
+
+BATCH_SIZE = int(os.getenv("CIRCLE_MAIL_BATCH_SIZE", "50"))
+POLL_SECONDS = float(os.getenv("CIRCLE_MAIL_POLL_SECONDS", "5"))
+MAX_ATTEMPTS = int(os.getenv("CIRCLE_MAIL_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE_SECONDS = 30.0
+BACKOFF_MAX_SECONDS = 3600.0
+# A claimed batch becomes eligible again after this long (worker crashed)
+LEASE_SECONDS = 300.0
+# Hang up the SMTP session after this long with nothing to send
+SMTP_IDLE_CLOSE_SECONDS = 60.0
+
+
+def _connect():
+    return connect(backend_db.DB_PATH)
+
+
+def ensure_outbox_table(conn: Optional[sqlite3.Connection] = None):
+    own = conn is None
+    conn = conn or _connect()
+    try:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                to_email TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                sent_at TEXT
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_email_outbox_due "
+            "ON email_outbox(next_attempt_at) WHERE status = 'pending'"
+        )
+        conn.commit()
+    finally:
+        if own:
+            conn.close()
+
+
+def enqueue_emails(messages) -> list:
+    """
+    Queue many (to_email, subject, body) tuples in one transaction.
+    Returns their outbox ids and wakes the worker. Raises ValueError (and
+    queues nothing) if any address is malformed.
+    """
+    messages = list(messages)
+    if not messages:
+        return []
+    for to_email, _subject, _body in messages:
+        if not valid_email_address(to_email):
+            raise ValueError(f"Invalid email address: {to_email!r}")
+    conn = _connect()
+    try:
+        ids = [
+            conn.execute(
+                """
+                INSERT INTO email_outbox (to_email, subject, body)
+                VALUES (?, ?, ?)
+                RETURNING id
+                """,
+                message,
+            ).fetchone()["id"]
+            for message in messages
+        ]
+        conn.commit()
+    finally:
+        conn.close()
+    if _worker is not None:
+        _worker.wake()
+    return ids
+
+
+def enqueue_email(to_email: str, subject: str, body: str) -> int:
+    """Queue one email; returns immediately with its outbox id."""
+    return enqueue_emails([(to_email, subject, body)])[0]
+
+
+def outbox_counts() -> dict:
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT status, COUNT(*) AS n FROM email_outbox GROUP BY status"
+        ).fetchall()
+    finally:
+        conn.close()
+    return {r["status"]: r["n"] for r in rows}
+
+
+def _backoff(attempts: int) -> float:
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)))
+
+
+class MailWorker(PeriodicWorker):
+    """Background thread that sends queued mail in batches."""
+
+    name = "mail-outbox"
+    run_on_start = True
+
+    def __init__(self, smtp: Optional[SMTPConnection] = None, batch_size: int = BATCH_SIZE):
+        super().__init__(POLL_SECONDS)
+        self.smtp = smtp or SMTPConnection()
+        self.batch_size = batch_size
+        self._last_send = 0.0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.last_delivery_error: Optional[str] = None
+
+    def _claim(self, conn) -> list:
+        now = time.time()
+        rows = conn.execute(
+            """
+            UPDATE email_outbox
+            SET next_attempt_at = ?
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at, id
+                LIMIT ?
+            )
+            RETURNING id, to_email, subject, body, attempts
+            """,
+            (now + LEASE_SECONDS, now, self.batch_size),
+        ).fetchall()
+        conn.commit()
+        return sorted(rows, key=lambda r: r["id"])
+
+    def run_once(self) -> int:
+        """Send one batch of due mail. Returns how many were processed."""
+        conn = _connect()
+        try:
+            rows = self._claim(conn)
+            for row in rows:
+                self._deliver(conn, row)
+        finally:
+            conn.close()
+        return len(rows)
+
+    def _record_failure(self, conn, row, error: Exception, permanent: bool):
+        attempts = row["attempts"] + 1
+        self.last_delivery_error = f"{type(error).__name__}: {error}"
+        permanent = permanent or attempts >= MAX_ATTEMPTS
+        conn.execute(
+            """
+            UPDATE email_outbox
+            SET attempts = ?, last_error = ?, next_attempt_at = ?,
+                status = ?
+            WHERE id = ?
+            """,
+            (
+                attempts,
+                self.last_delivery_error,
+                time.time() + _backoff(attempts),
+                "failed" if permanent else "pending",
+                row["id"],
+            ),
+        )
+        conn.commit()
+        if permanent:
+            self.failed += 1
+        else:
+            self.retried += 1
+
+    def _deliver(self, conn, row):
+        try:
+            self.smtp.send(build_message(row["to_email"], row["subject"], row["body"]))
+        except (smtplib.SMTPException, OSError) as e:
+            # Permanent rejections won't get better with retries
+            self._record_failure(
+                conn, row, e, permanent=isinstance(e, smtplib.SMTPRecipientsRefused)
+            )
+            # Connection may be unusable now
+            self.smtp.close()
+            return
+        except Exception as e:
+            # A message we can't even build (e.g. a header with a newline)
+            # fails the same way every time: give up on this row only
+            self._record_failure(conn, row, e, permanent=True)
+            return
+
+        conn.execute(
+            """
+            UPDATE email_outbox
+            SET status = 'sent', attempts = attempts + 1,
+                sent_at = CURRENT_TIMESTAMP, last_error = NULL
+            WHERE id = ?
+            """,
+            (row["id"],),
+        )
+        conn.commit()
+        self.sent += 1
+        self._last_send = time.monotonic()
+
+    def more_pending(self, processed) -> bool:
+        return processed >= self.batch_size
+
+    def on_idle(self):
+        if time.monotonic() - self._last_send > SMTP_IDLE_CLOSE_SECONDS:
+            self.smtp.close()
+
+    def on_stop(self):
+        self.smtp.close()
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "errors": self.errors,
+            "smtp_connects": self.smtp.connects,
+            "last_error": self.last_error,
+            "last_delivery_error": self.last_delivery_error,
+        }
+
+
+_worker: Optional[MailWorker] = None
+_worker_lock = threading.Lock()
+
+
+def start_mail_worker(**kwargs) -> Optional[MailWorker]:
+    """
+    Create the outbox table and start the worker (once per process).
+    Without SMTP settings mail just stays queued until it is configured.
+    """
+    global _worker
+    ensure_outbox_table()
+    if not smtp_configured():
+        print("❌ SMTP is not configured; emails will wait in the outbox.")
+        return None
+    with _worker_lock:
+        if _worker is None:
+            _worker = MailWorker(**kwargs)
+        _worker.start()
+    return _worker
+
+
+def stop_mail_worker(timeout: Optional[float] = 10.0):
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            _worker.stop(timeout)
+            _worker = None
@@ -1,5 +1,10 @@
 import os
+import threading
+import time
+from typing import Optional
+
 import requests
+from requests.adapters import HTTPAdapter
 
 
 # You will set these in your backend environment (.env or hosting env vars)
@@ -14,27 +19,203 @@ else:
     # default: sandbox
     PAYPAL_BASE_URL = "https://api-m.sandbox.paypal.com"
 
+# Point at a local stub server in tests / dev
+PAYPAL_BASE_URL = os.getenv("PAYPAL_BASE_URL", PAYPAL_BASE_URL)
 
-def _get_access_token() -> str:
+PAYPAL_TIMEOUT_SECONDS = float(os.getenv("PAYPAL_TIMEOUT_SECONDS", "10"))
+PAYPAL_POOL_SIZE = int(os.getenv("PAYPAL_POOL_SIZE", "10"))
+
+# Refresh the token this long before PayPal says it expires
+TOKEN_REFRESH_MARGIN_SECONDS = 120
+
+
+class PayPalClient:
     """
-    Get OAuth2 access token from PayPal.
+    PayPal REST client with a keep-alive connection pool and a cached
+    OAuth token.
+
+    The token is reused until TOKEN_REFRESH_MARGIN_SECONDS before its
+    expires_in runs out. Only one thread refreshes it; the others wait on
+    the lock and then reuse the fresh token instead of each fetching one.
     """
-    if not PAYPAL_CLIENT_ID or not PAYPAL_CLIENT_SECRET:
-        raise RuntimeError("PAYPAL_CLIENT_ID or PAYPAL_CLIENT_SECRET not set")
 
-    token_url = f"{PAYPAL_BASE_URL}/v1/oauth2/token"
+    def __init__(
+        self,
+        client_id: Optional[str] = None,
+        client_secret: Optional[str] = None,
+        base_url: Optional[str] = None,
+        timeout: float = PAYPAL_TIMEOUT_SECONDS,
+        pool_size: int = PAYPAL_POOL_SIZE,
+    ):
+        self.client_id = client_id or PAYPAL_CLIENT_ID
+        self.client_secret = client_secret or PAYPAL_CLIENT_SECRET
+        self.base_url = (base_url or PAYPAL_BASE_URL).rstrip("/")
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    # ----------------- token -----------------
 
-    # PayPal uses Basic Auth with client_id:client_secret
-    resp = requests.post(
-        token_url,
-        auth=(PAYPAL_CLIENT_ID, PAYPAL_CLIENT_SECRET),
-        data={"grant_type": "client_credentials"},
-        headers={"Accept": "application/json", "Accept-Language": "en_US"},
-        timeout=10,
-    )
-    resp.raise_for_status()
-    data = resp.json()
-    return data["access_token"]
+    def _fetch_token(self):
+        if not self.client_id or not self.client_secret:
+            raise RuntimeError("PAYPAL_CLIENT_ID or PAYPAL_CLIENT_SECRET not set")
+
+        # PayPal uses Basic Auth with client_id:client_secret
+        data = self._request(
+            "POST",
+            "/v1/oauth2/token",
+            auth=(self.client_id, self.client_secret),
+            data={"grant_type": "client_credentials"},
+            headers={"Accept": "application/json", "Accept-Language": "en_US"},
+        )
+        expires_in = float(data.get("expires_in", 0))
+        self._token = data["access_token"]
+        self._token_expires_at = time.monotonic() + max(
+            0.0, expires_in - TOKEN_REFRESH_MARGIN_SECONDS
+        )
+
+    def access_token(self) -> str:
+        """Cached OAuth2 access token, refreshed shortly before it expires."""
+        if self._token and time.monotonic() < self._token_expires_at:
+            return self._token
+        with self._token_lock:
+            # Someone else may have refreshed while we waited
+            if not self._token or time.monotonic() >= self._token_expires_at:
+                self._fetch_token()
+            return self._token
+
+    def invalidate_token(self, token: Optional[str] = None):
+        """Drop the cached token (only if it is still `token`, when given)."""
+        with self._token_lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._token_expires_at = 0.0
+
+    # ----------------- HTTP -----------------
+
+    def _record(self, endpoint: str, seconds: float, ok: bool):
+        with self._metrics_lock:
+            m = self._metrics.setdefault(
+                endpoint, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+            )
+            ms = seconds * 1000.0
+            m["calls"] += 1
+            m["total_ms"] += ms
+            m["max_ms"] = max(m["max_ms"], ms)
+            if not ok:
+                m["errors"] += 1
+
+    def _request(self, method: str, path: str, **kwargs) -> dict:
+        started = time.perf_counter()
+        ok = False
+        try:
+            resp = self.session.request(
+                method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs
+            )
+            resp.raise_for_status()
+            ok = True
+            return resp.json()
+        finally:
+            self._record(f"{method} {path}", time.perf_counter() - started, ok)
+
+    def _authorized(self, method: str, path: str, **kwargs) -> dict:
+        headers = dict(kwargs.pop("headers", {}))
+        token = self.access_token()
+        headers["Authorization"] = f"Bearer {token}"
+        try:
+            return self._request(method, path, headers=headers, **kwargs)
+        except requests.HTTPError as e:
+            # Token revoked / expired early: refresh once and retry. Other
+            # threads hitting the same 401 reuse whichever refresh wins.
+            if e.response is None or e.response.status_code != 401:
+                raise
+            self.invalidate_token(token)
+            headers["Authorization"] = f"Bearer {self.access_token()}"
+            return self._request(method, path, headers=headers, **kwargs)
+
+    # ----------------- API -----------------
+
+    def create_order(self, total_amount: str, currency: str = "USD") -> dict:
+        """
+        Create a PayPal order and return {id, approval_url}.
+        total_amount should be a string like "10.00".
+        """
+        body = {
+            "intent": "CAPTURE",
+            "purchase_units": [
+                {
+                    "amount": {
+                        "currency_code": currency,
+                        "value": total_amount,
+                    }
+                }
+            ],
+        }
+        data = self._authorized(
+            "POST",
+            "/v2/checkout/orders",
+            headers={"Content-Type": "application/json"},
+            json=body,
+        )
+
+        approval_url = None
+        for link in data.get("links", []):
+            if link.get("rel") == "approve":
+                approval_url = link.get("href")
+                break
+
+        return {
+            "id": data.get("id"),
+            "approval_url": approval_url,
+            "raw": data,
+        }
+
+    def stats(self) -> dict:
+        """Per-endpoint call counts, errors and latency (ms)."""
+        with self._metrics_lock:
+            return {
+                endpoint: {
+                    **m,
+                    "avg_ms": round(m["total_ms"] / m["calls"], 2) if m["calls"] else 0.0,
+                    "total_ms": round(m["total_ms"], 2),
+                    "max_ms": round(m["max_ms"], 2),
+                }
+                for endpoint, m in self._metrics.items()
+            }
+
+    def close(self):
+        self.session.close()
+
+
+_client: Optional[PayPalClient] = None
+_client_lock = threading.Lock()
+
+
+def get_paypal_client() -> PayPalClient:
+    """Process-wide client (shared session + token cache)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PayPalClient()
+    return _client
+
+
+def _get_access_token() -> str:
+    """
+    Get OAuth2 access token from PayPal (cached, see PayPalClient).
+    """
+    return get_paypal_client().access_token()
 
 
 def create_paypal_order(total_amount: str, currency: str = "USD") -> dict:
@@ -42,37 +223,4 @@ def create_paypal_order(total_amount: str, currency: str = "USD") -> dict:
     Create a PayPal order and return {id, approval_url}.
     total_amount should be a string like "10.00".
     """
-    access_token = _get_access_token()
-
-    orders_url = f"{PAYPAL_BASE_URL}/v2/checkout/orders"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-    }
-    body = {
-        "intent": "CAPTURE",
-        "purchase_units": [
-            {
-                "amount": {
-                    "currency_code": currency,
-                    "value": total_amount,
-                }
-            }
-        ],
-    }
-
-    resp = requests.post(orders_url, headers=headers, json=body, timeout=10)
-    resp.raise_for_status()
-    data = resp.json()
-
-    approval_url = None
-    for link in data.get("links", []):
-        if link.get("rel") == "approve":
-            approval_url = link.get("href")
-            break
-
-    return {
-        "id": data.get("id"),
-        "approval_url": approval_url,
-        "raw": data,
-    }
+    return get_paypal_client().create_order(total_amount, currency=currency)
@@ -0,0 +1,105 @@
+# core/blob_gc.py
+"""
+Periodic cleanup of the upload blob store (core.db.gc_orphan_blobs).
+
+Deleting a listing / replacing a profile photo only drops blob refcounts;
+photos that failed processing, EXIF-stripped originals and abandoned
+uploads have no row at all. This worker removes both kinds once they
+have been unreferenced for the grace period.
+
+Runs as a daemon thread inside the Streamlit process (app.py), next to
+the reservation sweeper, or on its own:
+
+    python -m core.blob_gc --once
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from . import db
+from .periodic import PeriodicWorker
+
+log = logging.getLogger(__name__)
+
+BLOB_GC_INTERVAL_SECONDS = float(os.getenv("CIRCLE_BLOB_GC_INTERVAL_SECONDS", "3600"))
+# Keeps in-flight uploads (stored, listing not saved yet) safe
+BLOB_GC_GRACE_SECONDS = int(os.getenv("CIRCLE_BLOB_GC_GRACE_SECONDS", str(24 * 3600)))
+
+
+class BlobCollector(PeriodicWorker):
+    """Daemon thread that calls gc_orphan_blobs on an interval."""
+
+    name = "blob-gc"
+
+    def __init__(
+        self,
+        interval_seconds: float = BLOB_GC_INTERVAL_SECONDS,
+        grace_seconds: int = BLOB_GC_GRACE_SECONDS,
+    ):
+        super().__init__(interval_seconds)
+        self.grace_seconds = grace_seconds
+        self.runs = 0
+        self.last_result: Optional[dict] = None
+
+    def run_once(self) -> dict:
+        started = time.monotonic()
+        result = db.gc_orphan_blobs(self.grace_seconds)
+        result["seconds"] = round(time.monotonic() - started, 4)
+        self.runs += 1
+        self.last_result = result
+        if result["blobs"] or result["files"]:
+            log.info("Blob GC: %s", result)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "errors": self.errors,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+_collector: Optional[BlobCollector] = None
+_collector_lock = threading.Lock()
+
+
+def start_blob_gc(**kwargs) -> BlobCollector:
+    """Start (once per process) and return the blob collector."""
+    global _collector
+    with _collector_lock:
+        if _collector is None:
+            _collector = BlobCollector(**kwargs)
+        _collector.start()
+    return _collector
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete unreferenced upload blobs.")
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    parser.add_argument("--interval", type=float, default=BLOB_GC_INTERVAL_SECONDS)
+    parser.add_argument("--grace", type=int, default=BLOB_GC_GRACE_SECONDS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    db.ensure_schema()
+    collector = BlobCollector(args.interval, args.grace)
+
+    if args.once:
+        print(collector.run_once())
+        return
+
+    collector.run_once()
+    collector.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        collector.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,3 +5,10 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 DB_PATH = os.path.join(BASE_DIR, "circle.db")
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
+
+# Max number of pooled SQLite connections per process (see core/pool.py)
+DB_POOL_SIZE = int(os.getenv("CIRCLE_DB_POOL_SIZE", "8"))
+
+# Fan-out-on-write friend timeline (see FRIEND TIMELINE in core/db.py).
+# Off by default: friend feeds are then computed with a join at read time.
+FRIEND_TIMELINE_ENABLED = os.getenv("CIRCLE_FRIEND_TIMELINE", "0") == "1"
@@ -3,11 +3,22 @@
 import sqlite3
 import json
 import os
+import re
 import secrets  # used in create_invite_code
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
 import streamlit as st
-from contextlib import closing
+from contextlib import closing, contextmanager
+from typing import Optional
 
-from .config import DB_PATH
+from . import storage
+from .config import DB_PATH, DB_POOL_SIZE, FRIEND_TIMELINE_ENABLED
+from .listing_view import ListingView
+from .migrations import MIGRATIONS, migrate
+from .pool import ConnectionPool
+from .sqlite_config import connect, start_checkpoint_scheduler
 
 
 def get_db():
@@ -22,215 +33,264 @@ def get_db():
 
 
 def get_connection():
-    """Return a SQLite connection with Row dict-like access."""
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """
+    Return a standalone SQLite connection with Row dict-like access.
+    Helpers below use the shared pool instead; this is for one-off scripts.
+    """
+    return connect(DB_PATH)
+
+
+# One pool per process, shared by every helper in this module (and every
+# Streamlit session thread). Connections are opened lazily and reused;
+# WAL / busy_timeout / cache PRAGMAs are applied once per connection.
+_pool = ConnectionPool(DB_PATH, max_size=DB_POOL_SIZE)
+
+
+def get_pool() -> ConnectionPool:
+    """Expose the shared pool (for metrics / health checks)."""
+    return _pool
+
+
+# ---------- UNIT OF WORK ----------
+#
+# Every helper below opens its own pooled connection and commits on exit
+# (one fsync per call). Inside `with unit_of_work():` they all share this
+# thread's connection instead, and everything commits – or rolls back –
+# once when the block exits. Feed-cache invalidation is held back until
+# that commit, so other sessions never cache half-finished batches.
+
+_uow = threading.local()
+
+
+@contextmanager
+def unit_of_work():
+    """Group several core.db writes into one transaction. Nests (joins outer)."""
+    if getattr(_uow, "conn", None) is not None:
+        yield _uow.conn
+        return
+
+    _uow.listings_dirty = False
+    try:
+        with _pool.connection() as conn:
+            _uow.conn = conn
+            try:
+                yield conn
+            finally:
+                _uow.conn = None
+    except BaseException:
+        _uow.listings_dirty = False
+        raise
+    if _uow.listings_dirty:
+        _uow.listings_dirty = False
+        _bump_listings_generation()
+
+
+def in_unit_of_work() -> bool:
+    return getattr(_uow, "conn", None) is not None
+
+
+@contextmanager
+def _db():
+    """The current unit of work's connection, else a pooled one that commits on exit."""
+    conn = getattr(_uow, "conn", None)
+    if conn is not None:
+        yield conn
+    else:
+        with _pool.connection() as conn:
+            yield conn
 
 
 def init_db():
     """
-    Initialize DB tables if they don't exist.
+    Bring the DB schema up to date (tables, columns, indexes).
     We DO NOT drop tables here, so data persists across reruns.
-    Also ensure new columns exist via ALTER TABLE calls.
+    Versioned via PRAGMA user_version – see core/migrations.py. When the
+    schema is already current this is a single header read, no DDL.
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    # Keep the WAL file in check (no-op if already running in this process)
+    start_checkpoint_scheduler(DB_PATH)
 
-    # ---------------- USERS ----------------
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            display_name TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            phone TEXT,
-            inviter_name TEXT,
-            password_hash TEXT,
-            profile_image_path TEXT,
-            invited_by_user_id INTEGER,
-            stripe_account_id TEXT,
-            stripe_onboarded INTEGER DEFAULT 0,
-            FOREIGN KEY (invited_by_user_id) REFERENCES users(id)
-        )
-        """
-    )
+    with _pool.connection() as conn:
+        migrate(conn, MIGRATIONS)
 
-    # ---------------- LISTINGS ----------------
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS listings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            description TEXT NOT NULL,
-            price REAL NOT NULL,
-            image_path TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            brand TEXT,
-            category TEXT,
-            condition TEXT,
-            retail_price REAL,
-            image_paths TEXT,
-            status TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-        """
-    )
+    # The flag may have been off while listings/friendships changed
+    if FRIEND_TIMELINE_ENABLED:
+        rebuild_friend_timeline()
 
-    # ---------------- FRIENDSHIPS ----------------
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS friendships (
-            user_id INTEGER NOT NULL,
-            friend_user_id INTEGER NOT NULL,
-            PRIMARY KEY (user_id, friend_user_id),
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            FOREIGN KEY (friend_user_id) REFERENCES users(id)
-        )
-        """
-    )
 
-    # ---------------- INVITES ----------------
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS invites (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            inviter_user_id INTEGER NOT NULL,
-            code TEXT UNIQUE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (inviter_user_id) REFERENCES users(id)
-        )
-        """
-    )
+# Streamlit re-executes app.py on every click, but this module is imported
+# once per process – so remember that the schema is done.
+_schema_ready = False
+_schema_lock = threading.Lock()
 
-    # ---------------- ORDERS ----------------
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            buyer_id INTEGER NOT NULL,
-            seller_id INTEGER NOT NULL,
-            listing_id INTEGER NOT NULL,
-            status TEXT NOT NULL,
-            total_price REAL NOT NULL,
-            shipping_name TEXT,
-            shipping_address1 TEXT,
-            shipping_address2 TEXT,
-            shipping_city TEXT,
-            shipping_state TEXT,
-            shipping_postal_code TEXT,
-            shipping_country TEXT,
-            shipping_phone TEXT,
-            payment_method TEXT,
-            buyer_note TEXT,
-            tracking_number TEXT,
-            carrier TEXT,
-            estimated_delivery_date TEXT,
-            stripe_session_id TEXT,
-            stripe_payment_intent_id TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (buyer_id) REFERENCES users(id),
-            FOREIGN KEY (seller_id) REFERENCES users(id),
-            FOREIGN KEY (listing_id) REFERENCES listings(id)
+
+def ensure_schema():
+    """
+    Run init_db() once per process (thread-safe). Every later call is a
+    plain flag check, so it's fine to call at the top of each rerun.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            init_db()
+            _schema_ready = True
+
+
+def schema_ready() -> bool:
+    """True once ensure_schema() has completed in this process."""
+    return _schema_ready
+
+
+# ---------- FEED CACHE ----------
+#
+# Home re-runs the feed queries on every click (likes, cart, carousel),
+# but listings rarely change between clicks. Feed helpers below are
+# wrapped in a process-wide read-through cache keyed by
+# (helper, arguments, feed generation), so old entries simply stop
+# matching after a write – nothing has to be found and deleted.
+#
+# The generation is a row in the DB (feed_generation, migration v11),
+# bumped by triggers on listings / friendships / display names in the
+# writer's own transaction. Writes from other processes (the backend,
+# core.sweeper, another Streamlit worker) are therefore seen on the very
+# next call, at the cost of one primary-key read per cached call. Writes
+# from this process also clear the local cache right after commit
+# (_bump_listings_generation) so dead entries don't linger.
+#
+# Callers get their own copy of a cached list: mutating it can't
+# corrupt what the next caller sees. Entries are evicted LRU-style past
+# FEED_CACHE_SIZE.
+
+FEED_CACHE_SIZE = int(os.getenv("CIRCLE_FEED_CACHE_SIZE", "256"))
+
+_local_generation = 0
+_feed_cache = OrderedDict()
+_feed_cache_lock = threading.Lock()
+_feed_cache_stats = {"hits": 0, "misses": 0}
+
+
+def listings_generation() -> int:
+    """Current feed generation (changes after every feed-visible write)."""
+    with _db() as conn:
+        row = conn.execute("SELECT value FROM feed_generation WHERE id = 1").fetchone()
+    return row["value"] if row else 0
+
+
+def _bump_listings_generation():
+    global _local_generation
+    if in_unit_of_work():
+        # Not committed yet – unit_of_work() bumps once it is
+        _uow.listings_dirty = True
+        return
+    with _feed_cache_lock:
+        _local_generation += 1
+        # Everything cached so far is unreachable now; free it right away
+        _feed_cache.clear()
+
+
+def _freeze(value):
+    """Make call arguments hashable (filters dicts, list cursors, ...)."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _copy_result(value):
+    """Fresh lists for a cached result (rows, or a (rows, cursor) page)."""
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, tuple):
+        return tuple(_copy_result(v) for v in value)
+    return value
+
+
+def _feed_cached(func):
+    """Cache a read-only feed helper until the next feed-visible write."""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # Inside a unit of work we may see our own uncommitted writes
+        if in_unit_of_work():
+            return func(*args, **kwargs)
+
+        local_generation = _local_generation
+        key = (
+            func.__name__,
+            _freeze(args),
+            _freeze(kwargs),
+            listings_generation(),
         )
-        """
-    )
 
-    # ---- Schema upgrade for existing DBs: add missing columns on users ----
-    for col, col_def in [
-        ("first_name", "TEXT"),
-        ("last_name", "TEXT"),
-        ("phone", "TEXT"),
-        ("inviter_name", "TEXT"),
-        ("password_hash", "TEXT"),
-        ("profile_image_path", "TEXT"),
-        ("invited_by_user_id", "INTEGER"),
-        ("stripe_account_id", "TEXT"),
-        ("stripe_onboarded", "INTEGER DEFAULT 0"),
-    ]:
-        try:
-            cur.execute(f"ALTER TABLE users ADD COLUMN {col} {col_def}")
-        except sqlite3.OperationalError:
-            # column already exists or table was just created
-            pass
+        with _feed_cache_lock:
+            if key in _feed_cache:
+                _feed_cache.move_to_end(key)
+                _feed_cache_stats["hits"] += 1
+                return _copy_result(_feed_cache[key])
+            _feed_cache_stats["misses"] += 1
 
-    # ---- Schema upgrade for existing DBs: add missing columns on listings ----
-    for col, col_def in [
-        ("brand", "TEXT"),
-        ("category", "TEXT"),
-        ("condition", "TEXT"),
-        ("retail_price", "REAL"),
-        ("image_paths", "TEXT"),
-        ("status", "TEXT"),  # e.g. 'draft', 'published', 'inactive'
-    ]:
-        try:
-            cur.execute(f"ALTER TABLE listings ADD COLUMN {col} {col_def}")
-        except sqlite3.OperationalError:
-            # column already exists or table was just created
-            pass
+        value = func(*args, **kwargs)
 
-    # ---- Schema upgrade for existing DBs: add missing columns on orders ----
-    for col, col_def in [
-        ("tracking_number", "TEXT"),
-        ("carrier", "TEXT"),
-        ("estimated_delivery_date", "TEXT"),
-        ("stripe_session_id", "TEXT"),
-        ("stripe_payment_intent_id", "TEXT"),
-    ]:
-        try:
-            cur.execute(f"ALTER TABLE orders ADD COLUMN {col} {col_def}")
-        except sqlite3.OperationalError:
-            # column already exists or table was just created
-            pass
+        with _feed_cache_lock:
+            # A local write cleared the cache while we were querying: don't
+            # re-add a result that may predate it
+            if local_generation == _local_generation:
+                _feed_cache[key] = _copy_result(value)
+                while len(_feed_cache) > FEED_CACHE_SIZE:
+                    _feed_cache.popitem(last=False)
+        return value
+
+    return wrapper
 
-    conn.commit()
-    conn.close()
+
+def feed_cache_stats() -> dict:
+    with _feed_cache_lock:
+        stats = {**_feed_cache_stats, "entries": len(_feed_cache)}
+    stats["generation"] = listings_generation()
+    return stats
 
 
 # ---------- USER HELPERS ----------
 
 
 def get_user_by_email(email: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, email, display_name,
-               first_name, last_name, phone,
-               inviter_name, password_hash, profile_image_path,
-               invited_by_user_id,
-               stripe_account_id, stripe_onboarded
-        FROM users
-        WHERE email = ?
-        """,
-        (email,),
-    )
-    row = cur.fetchone()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, email, display_name,
+                   first_name, last_name, phone,
+                   inviter_name, password_hash, profile_image_path,
+                   invited_by_user_id,
+                   stripe_account_id, stripe_onboarded
+            FROM users
+            WHERE email = ?
+            """,
+            (email,),
+        )
+        row = cur.fetchone()
     return row
 
 
 def get_user_by_id(user_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, email, display_name,
-               first_name, last_name, phone,
-               inviter_name, password_hash, profile_image_path,
-               invited_by_user_id,
-               stripe_account_id, stripe_onboarded
-        FROM users
-        WHERE id = ?
-        """,
-        (user_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, email, display_name,
+                   first_name, last_name, phone,
+                   inviter_name, password_hash, profile_image_path,
+                   invited_by_user_id,
+                   stripe_account_id, stripe_onboarded
+            FROM users
+            WHERE id = ?
+            """,
+            (user_id,),
+        )
+        row = cur.fetchone()
     return row
 
 
@@ -247,34 +307,32 @@ def create_user(
     Create a new user with extended profile info.
     invited_by_user_id: the user_id of the inviter (if they signed up via invite).
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    with _db() as conn:
+        cur = conn.cursor()
 
-    base_display = first_name or email.split("@")[0]
+        base_display = first_name or email.split("@")[0]
 
-    cur.execute(
-        """
-        INSERT INTO users (
-            email, display_name,
-            first_name, last_name, phone,
-            inviter_name, password_hash, invited_by_user_id
+        cur.execute(
+            """
+            INSERT INTO users (
+                email, display_name,
+                first_name, last_name, phone,
+                inviter_name, password_hash, invited_by_user_id
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                email,
+                base_display,
+                first_name,
+                last_name,
+                phone,
+                inviter_name,
+                password_hash,
+                invited_by_user_id,
+            ),
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            email,
-            base_display,
-            first_name,
-            last_name,
-            phone,
-            inviter_name,
-            password_hash,
-            invited_by_user_id,
-        ),
-    )
-    conn.commit()
-    user_id = cur.lastrowid
-    conn.close()
+        user_id = cur.lastrowid
     return user_id
 
 
@@ -299,81 +357,81 @@ def insert_user_if_not_exists(email, display_name=None):
 
 def get_all_users():
     """Return all users in the system."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, email, display_name,
-               first_name, last_name, phone,
-               inviter_name, profile_image_path,
-               invited_by_user_id,
-               stripe_account_id, stripe_onboarded
-        FROM users
-        ORDER BY id ASC
-        """
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, email, display_name,
+                   first_name, last_name, phone,
+                   inviter_name, profile_image_path,
+                   invited_by_user_id,
+                   stripe_account_id, stripe_onboarded
+            FROM users
+            ORDER BY id ASC
+            """
+        )
+        rows = cur.fetchall()
     return rows
 
 
 def get_users_invited_by(inviter_user_id: int):
     """Return users who were invited by this user and successfully signed up."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT
-            id,
-            email,
-            display_name,
-            first_name,
-            last_name,
-            profile_image_path,
-            stripe_account_id,
-            stripe_onboarded
-        FROM users
-        WHERE invited_by_user_id = ?
-        ORDER BY id ASC
-        """,
-        (inviter_user_id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT
+                id,
+                email,
+                display_name,
+                first_name,
+                last_name,
+                profile_image_path,
+                stripe_account_id,
+                stripe_onboarded
+            FROM users
+            WHERE invited_by_user_id = ?
+            ORDER BY id ASC
+            """,
+            (inviter_user_id,),
+        )
+        rows = cur.fetchall()
     return rows
 
 
 def update_user_display_name(user_id: int, display_name: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE users SET display_name = ? WHERE id = ?",
-        (display_name, user_id),
-    )
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE users SET display_name = ? WHERE id = ?",
+            (display_name, user_id),
+        )
+    # Seller names are part of every feed row
+    _bump_listings_generation()
 
 
 def update_user_profile_image(user_id: int, image_path: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE users SET profile_image_path = ? WHERE id = ?",
-        (image_path, user_id),
-    )
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT profile_image_path FROM users WHERE id = ?", (user_id,))
+        row = cur.fetchone()
+        cur.execute(
+            "UPDATE users SET profile_image_path = ? WHERE id = ?",
+            (image_path, user_id),
+        )
+        if cur.rowcount > 0:
+            _adjust_blob_refs(cur, [image_path], +1)
+            if row and row["profile_image_path"]:
+                _adjust_blob_refs(cur, [row["profile_image_path"]], -1)
 
 
 def update_user_password_hash(user_id: int, password_hash: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE users SET password_hash = ? WHERE id = ?",
-        (password_hash, user_id),
-    )
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE users SET password_hash = ? WHERE id = ?",
+            (password_hash, user_id),
+        )
 
 
 def update_user_stripe_account(
@@ -385,22 +443,68 @@ def update_user_stripe_account(
     Save the Stripe Connect account ID for a user.
     onboarded=False for now; later we can flip it to True after verification.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE users
-        SET stripe_account_id = ?, stripe_onboarded = ?
-        WHERE id = ?
-        """,
-        (stripe_account_id, 1 if onboarded else 0, user_id),
-    )
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE users
+            SET stripe_account_id = ?, stripe_onboarded = ?
+            WHERE id = ?
+            """,
+            (stripe_account_id, 1 if onboarded else 0, user_id),
+        )
 
 
 # ---------- LISTING HELPERS ----------
 
+_INSERT_LISTING_SQL = """
+    INSERT INTO listings (
+        user_id, title, description, price,
+        image_path, brand, category, condition,
+        retail_price, image_paths, status, image_variants
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _listing_insert_params(
+    user_id,
+    title,
+    description,
+    price,
+    brand=None,
+    category=None,
+    condition=None,
+    retail_price=None,
+    image_paths=None,
+    status="published",
+    image_variants=None,
+):
+    """Row tuple for _INSERT_LISTING_SQL (JSON-encodes the image lists)."""
+    if image_paths:
+        image_paths_json = json.dumps(image_paths)
+        main_image_path = image_paths[0]
+    else:
+        image_paths_json = None
+        main_image_path = None
+
+    image_variants_json = json.dumps(image_variants) if image_variants else None
+
+    return (
+        user_id,
+        title,
+        description,
+        price,
+        main_image_path,
+        brand,
+        category,
+        condition,
+        retail_price,
+        image_paths_json,
+        status,
+        image_variants_json,
+    )
+
 
 def insert_listing(
     user_id,
@@ -413,129 +517,486 @@ def insert_listing(
     retail_price=None,
     image_paths=None,  # list of paths or None
     status="published",
+    image_variants=None,  # list of {variant: path} dicts, parallel to image_paths
 ):
     """
     Insert a new listing.
 
     image_paths: list of file paths (will be JSON-serialized).
     status: 'published', 'draft', or 'inactive'.
+    image_variants: resized copies per image from
+        core.storage.generate_image_variants (will be JSON-serialized).
     """
-    if image_paths:
-        image_paths_json = json.dumps(image_paths)
-        main_image_path = image_paths[0]
-    else:
-        image_paths_json = None
-        main_image_path = None
-
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO listings (
-            user_id, title, description, price,
-            image_path, brand, category, condition,
-            retail_price, image_paths, status
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            user_id,
-            title,
-            description,
-            price,
-            main_image_path,
-            brand,
-            category,
-            condition,
-            retail_price,
-            image_paths_json,
-            status,
-        ),
+    params = _listing_insert_params(
+        user_id,
+        title,
+        description,
+        price,
+        brand,
+        category,
+        condition,
+        retail_price,
+        image_paths,
+        status,
+        image_variants,
     )
-    conn.commit()
-    listing_id = cur.lastrowid
-    conn.close()
+
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(_INSERT_LISTING_SQL, params)
+        listing_id = cur.lastrowid
+        _adjust_blob_refs(cur, image_paths or [], +1)
+        if FRIEND_TIMELINE_ENABLED and status == "published":
+            _timeline_fan_out(cur, listing_id)
+    _bump_listings_generation()
     return listing_id
 
 
 def get_listings_for_user(user_id):
     """Return all listings created by a specific user."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT
-            l.id,
-            l.title,
-            l.description,
-            l.price,
-            l.image_path,
-            l.created_at,
-            l.brand,
-            l.category,
-            l.condition,
-            l.retail_price,
-            l.image_paths,
-            l.status
-        FROM listings l
-        WHERE l.user_id = ?
-        ORDER BY l.created_at DESC
-        """,
-        (user_id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT
+                l.id,
+                l.title,
+                l.description,
+                l.price,
+                l.image_path,
+                l.created_at,
+                l.brand,
+                l.category,
+                l.condition,
+                l.retail_price,
+                l.image_paths,
+                l.image_variants,
+                l.status,
+                u.display_name AS seller_name
+            FROM listings l
+            JOIN users u ON u.id = l.user_id
+            WHERE l.user_id = ?
+            ORDER BY l.created_at DESC
+            """,
+            (user_id,),
+        )
+        return [ListingView(r) for r in cur.fetchall()]
 
 
 def get_listing_by_id(listing_id: int):
     """Fetch a single listing with seller info."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT
-            l.id,
-            l.user_id,
-            l.title,
-            l.description,
-            l.price,
-            l.image_path,
-            l.created_at,
-            l.brand,
-            l.category,
-            l.condition,
-            l.retail_price,
-            l.image_paths,
-            l.status,
-            u.display_name AS seller_name
-        FROM listings l
-        JOIN users u ON u.id = l.user_id
-        WHERE l.id = ?
-        """,
-        (listing_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT
+                l.id,
+                l.user_id,
+                l.title,
+                l.description,
+                l.price,
+                l.image_path,
+                l.created_at,
+                l.brand,
+                l.category,
+                l.condition,
+                l.retail_price,
+                l.image_paths,
+                l.image_variants,
+                l.status,
+                u.display_name AS seller_name
+            FROM listings l
+            JOIN users u ON u.id = l.user_id
+            WHERE l.id = ?
+            """,
+            (listing_id,),
+        )
+        row = cur.fetchone()
     return row
 
 
 def get_listings_by_ids(listing_ids):
     """
-    Fetch listings (with seller name) for a given list of IDs.
-    Returns [] if list is empty.
+    Fetch listings (with seller name) for a given list of IDs, as
+    ListingView objects. Returns [] if list is empty.
     """
     if not listing_ids:
         return []
 
-    conn = get_connection()
-    cur = conn.cursor()
+    with _db() as conn:
+        cur = conn.cursor()
+
+        placeholders = ",".join("?" for _ in listing_ids)
+        query = f"""
+            SELECT
+                l.id,
+                l.user_id,
+                l.title,
+                l.description,
+                l.price,
+                l.image_path,
+                l.created_at,
+                l.brand,
+                l.category,
+                l.condition,
+                l.retail_price,
+                l.image_paths,
+                l.image_variants,
+                l.status,
+                u.display_name AS seller_name
+            FROM listings l
+            JOIN users u ON u.id = l.user_id
+            WHERE l.id IN ({placeholders})
+        """
+
+        cur.execute(query, listing_ids)
+        rows = [ListingView(r) for r in cur.fetchall()]
+    return rows
+
+
+@_feed_cached
+def get_all_listings():
+    """Return all *published* listings with seller display name."""
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT
+                l.id,
+                l.title,
+                l.description,
+                l.price,
+                l.image_path,
+                l.created_at,
+                l.brand,
+                l.category,
+                l.condition,
+                l.retail_price,
+                l.image_paths,
+                l.image_variants,
+                l.status,
+                u.display_name AS seller_name
+            FROM listings l
+            JOIN users u ON u.id = l.user_id
+            WHERE l.status = 'published'
+            ORDER BY l.created_at DESC, l.id DESC
+            """
+        )
+        rows = [ListingView(r) for r in cur.fetchall()]
+    return rows
+
+
+# ---------- FEED PAGINATION ----------
+#
+# Feeds are ordered newest-first on (created_at, id) and paged with a
+# keyset cursor: the (created_at, id) of the last row on the previous
+# page. Each page is one index range scan of page_size + 1 rows, so page
+# N costs the same as page 1 no matter how big the catalog is.
+
+FEED_PAGE_SIZE = 20
+
+
+def _keyset_page(rows, page_size: int, sort_key: str = "created_at"):
+    """Split a page_size + 1 fetch into (rows, next_cursor or None)."""
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, (last[sort_key], last["id"])
+
+
+@_feed_cached
+def get_listings_page(cursor=None, page_size: int = FEED_PAGE_SIZE):
+    """
+    One page of *published* listings (with seller name), newest first.
+    cursor: None for the first page, else the next_cursor from the
+    previous call. Returns (rows, next_cursor); next_cursor is None on
+    the last page.
+    """
+    params = []
+    after = ""
+    if cursor is not None:
+        after = "AND (l.created_at, l.id) < (?, ?)"
+        params.extend(cursor)
+    params.append(page_size + 1)
+
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT
+                l.id,
+                l.title,
+                l.description,
+                l.price,
+                l.image_path,
+                l.created_at,
+                l.brand,
+                l.category,
+                l.condition,
+                l.retail_price,
+                l.image_paths,
+                l.image_variants,
+                l.status,
+                u.display_name AS seller_name
+            FROM listings l
+            JOIN users u ON u.id = l.user_id
+            WHERE l.status = 'published'
+              {after}
+            ORDER BY l.created_at DESC, l.id DESC
+            LIMIT ?
+            """,
+            params,
+        )
+        rows = [ListingView(r) for r in cur.fetchall()]
+    return _keyset_page(rows, page_size)
+
+
+def get_popular_listings_page(cursor=None, page_size: int = FEED_PAGE_SIZE):
+    """
+    One page of *published* listings, most liked first (ties: newest id).
+    Walks idx_listing_stats_likes backwards – no COUNT(*) at read time.
+    (CROSS JOIN pins listing_stats as the outer loop; otherwise the
+    planner may start from the status index and sort in a temp B-tree.)
+    Not feed-cached: likes don't bump the listings generation, and the
+    query is a short index scan anyway. Returns (rows, next_cursor).
+    """
+    params = []
+    after = ""
+    if cursor is not None:
+        after = "AND (s.like_count, s.listing_id) < (?, ?)"
+        params.extend(cursor)
+    params.append(page_size + 1)
+
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT
+                l.id,
+                l.title,
+                l.description,
+                l.price,
+                l.image_path,
+                l.created_at,
+                l.brand,
+                l.category,
+                l.condition,
+                l.retail_price,
+                l.image_paths,
+                l.image_variants,
+                l.status,
+                u.display_name AS seller_name,
+                s.like_count
+            FROM listing_stats s
+            CROSS JOIN listings l ON l.id = s.listing_id
+            JOIN users u ON u.id = l.user_id
+            WHERE l.status = 'published'
+              {after}
+            ORDER BY s.like_count DESC, s.listing_id DESC
+            LIMIT ?
+            """,
+            params,
+        )
+        rows = [ListingView(r) for r in cur.fetchall()]
+    return _keyset_page(rows, page_size, sort_key="like_count")
+
+
+def delete_listing(user_id: int, listing_id: int) -> bool:
+    """Permanently delete a listing, only if it belongs to this user."""
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT image_paths FROM listings WHERE id = ? AND user_id = ?",
+            (listing_id, user_id),
+        )
+        row = cur.fetchone()
+        cur.execute(
+            "DELETE FROM listings WHERE id = ? AND user_id = ?",
+            (listing_id, user_id),
+        )
+        deleted = cur.rowcount > 0
+        if deleted and row and row["image_paths"]:
+            _adjust_blob_refs(cur, json.loads(row["image_paths"]), -1)
+        if deleted and FRIEND_TIMELINE_ENABLED:
+            _timeline_prune(cur, listing_id)
+    if deleted:
+        _bump_listings_generation()
+    return deleted
+
+
+def update_listing_status(user_id: int, listing_id: int, status: str) -> bool:
+    """Update a listing status (draft/published/inactive), only if it belongs to this user."""
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE listings SET status = ? WHERE id = ? AND user_id = ?",
+            (status, listing_id, user_id),
+        )
+        updated = cur.rowcount > 0
+        if updated and FRIEND_TIMELINE_ENABLED:
+            if status == "published":
+                _timeline_fan_out(cur, listing_id)
+            else:
+                _timeline_prune(cur, listing_id)
+    if updated:
+        _bump_listings_generation()
+    return updated
+
+
+# ---------- SEARCH ----------
+
+# bm25 column weights, in listings_fts column order:
+# title, brand, category, condition, description, seller_name
+_SEARCH_WEIGHTS = (10.0, 6.0, 3.0, 2.0, 1.0, 4.0)
+
+# Optional filters accepted by search_listings -> SQL (one bound param each)
+_SEARCH_FILTERS = {
+    "category": "l.category = ?",
+    "condition": "l.condition = ?",
+    "brand": "l.brand = ?",
+    "seller_id": "l.user_id = ?",
+    "friends_of": "l.user_id IN (SELECT friend_user_id FROM friendships WHERE user_id = ?)",
+}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _fts_match_expression(query: str):
+    """
+    Turn free text into an FTS5 MATCH expression: every word must match,
+    each as a prefix ("chan bag" -> "chan"* "bag"*). Quoting each token
+    keeps user input from being parsed as FTS syntax.
+    """
+    tokens = _TOKEN_RE.findall(query or "")
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+
+@_feed_cached
+def search_listings(query: str, filters=None, cursor=None, page_size: int = FEED_PAGE_SIZE):
+    """
+    Full-text search over *published* listings (title, brand, category,
+    condition, description, seller name), best match first (bm25).
+
+    filters: optional dict with any of category / condition / brand /
+             seller_id / friends_of (a user_id: only that user's friends).
+    cursor:  None for the first page, else next_cursor from the last call.
+    Returns (rows, next_cursor) like get_listings_page.
+    """
+    match = _fts_match_expression(query)
+    if match is None:
+        return [], None
+
+    weights = ", ".join(str(w) for w in _SEARCH_WEIGHTS)
+    params = [match]
+    where = ["l.status = 'published'"]
+
+    for key, value in (filters or {}).items():
+        if value is None:
+            continue
+        if key not in _SEARCH_FILTERS:
+            raise ValueError(f"Unknown search filter: {key}")
+        where.append(_SEARCH_FILTERS[key])
+        params.append(value)
+
+    if cursor is not None:
+        where.append("(h.rank, l.id) > (?, ?)")
+        params.extend(cursor)
+    params.append(page_size + 1)
+
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            WITH hits AS (
+                SELECT rowid AS listing_id,
+                       bm25(listings_fts, {weights}) AS rank
+                FROM listings_fts
+                WHERE listings_fts MATCH ?
+            )
+            SELECT
+                l.id,
+                l.title,
+                l.description,
+                l.price,
+                l.image_path,
+                l.created_at,
+                l.brand,
+                l.category,
+                l.condition,
+                l.retail_price,
+                l.image_paths,
+                l.image_variants,
+                l.status,
+                u.display_name AS seller_name,
+                h.rank
+            FROM hits h
+            JOIN listings l ON l.id = h.listing_id
+            JOIN users u ON u.id = l.user_id
+            WHERE {" AND ".join(where)}
+            ORDER BY h.rank, l.id
+            LIMIT ?
+            """,
+            params,
+        )
+        rows = [ListingView(r) for r in cur.fetchall()]
+    return _keyset_page(rows, page_size, sort_key="rank")
+
+
+# ---------- FRIENDSHIP HELPERS ----------
+
 
-    placeholders = ",".join("?" for _ in listing_ids)
-    query = f"""
+def get_friend_ids(user_id):
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT friend_user_id FROM friendships WHERE user_id = ?",
+            (user_id,),
+        )
+        rows = cur.fetchall()
+    return [r["friend_user_id"] for r in rows]
+
+
+# The friend feed is one statement: the user's circle (a CTE over the
+# friendships PK, which already leads with user_id) joined to listings via
+# idx_listings_user_created_id. CROSS JOIN pins that join order – left to
+# itself the planner walks idx_listings_status_created_id over the whole
+# catalog and probes friendships per row, so a user with no friends paid
+# for a full scan. Driven from the circle, an empty circle ends the query
+# at once and the cost follows the friends' listings, not the catalog.
+# The SQL text only depends on `depth`, so it is prepared once per
+# connection no matter how many friends a user has.
+
+_FRIEND_CIRCLE_SQL = {
+    1: """
+        circle(member_id) AS (
+            SELECT friend_user_id FROM friendships WHERE user_id = :user_id
+        )
+    """,
+    # Friends plus friends-of-friends (curated circle), never the user themselves
+    2: """
+        circle(member_id) AS (
+            SELECT friend_user_id FROM friendships WHERE user_id = :user_id
+            UNION
+            SELECT f2.friend_user_id
+            FROM friendships f1
+            JOIN friendships f2 ON f2.user_id = f1.friend_user_id
+            WHERE f1.user_id = :user_id
+              AND f2.friend_user_id != :user_id
+        )
+    """,
+}
+
+
+def _friend_feed_query(depth: int, after: str = "", limit: bool = False) -> str:
+    if depth not in _FRIEND_CIRCLE_SQL:
+        raise ValueError(f"Unsupported friend feed depth: {depth}")
+    return f"""
+        WITH {_FRIEND_CIRCLE_SQL[depth]}
         SELECT
             l.id,
-            l.user_id,
             l.title,
             l.description,
             l.price,
@@ -546,25 +1007,97 @@ def get_listings_by_ids(listing_ids):
             l.condition,
             l.retail_price,
             l.image_paths,
+            l.image_variants,
             l.status,
             u.display_name AS seller_name
-        FROM listings l
+        FROM circle c
+        CROSS JOIN listings l ON l.user_id = c.member_id
         JOIN users u ON u.id = l.user_id
-        WHERE l.id IN ({placeholders})
+        WHERE l.status = 'published'
+          {after}
+        ORDER BY l.created_at DESC, l.id DESC
+        {"LIMIT :limit" if limit else ""}
     """
 
-    cur.execute(query, listing_ids)
-    rows = cur.fetchall()
-    conn.close()
+
+@_feed_cached
+def get_friend_listings(user_id, depth: int = 1):
+    """
+    Return *published* listings only from the user's friends.
+    depth=2 also includes friends of friends.
+    """
+    query = (
+        _timeline_feed_query()
+        if FRIEND_TIMELINE_ENABLED and depth == 1
+        else _friend_feed_query(depth)
+    )
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(query, {"user_id": user_id})
+        rows = [ListingView(r) for r in cur.fetchall()]
     return rows
 
 
-def get_all_listings():
-    """Return all *published* listings with seller display name."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
+@_feed_cached
+def get_friend_listings_page(
+    user_id, cursor=None, page_size: int = FEED_PAGE_SIZE, depth: int = 1
+):
+    """
+    Keyset-paginated version of get_friend_listings.
+    Returns (rows, next_cursor) – see get_listings_page.
+    """
+    use_timeline = FRIEND_TIMELINE_ENABLED and depth == 1
+    params = {"user_id": user_id, "limit": page_size + 1}
+    after = ""
+    if cursor is not None:
+        after = (
+            "AND (t.created_at, t.listing_id) < (:after_created_at, :after_id)"
+            if use_timeline
+            else "AND (l.created_at, l.id) < (:after_created_at, :after_id)"
+        )
+        params["after_created_at"], params["after_id"] = cursor
+
+    if use_timeline:
+        query = _timeline_feed_query(after, limit=True)
+    else:
+        query = _friend_feed_query(depth, after, limit=True)
+
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        rows = [ListingView(r) for r in cur.fetchall()]
+    return _keyset_page(rows, page_size)
+
+
+def add_friend(user_id, friend_user_id):
+    """Create a friendship link if it doesn’t exist yet."""
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT OR IGNORE INTO friendships (user_id, friend_user_id)
+            VALUES (?, ?)
+            """,
+            (user_id, friend_user_id),
+        )
+        added = cur.rowcount > 0
+        if added and FRIEND_TIMELINE_ENABLED:
+            _timeline_follow(cur, (user_id, friend_user_id))
+    if added:
+        _bump_listings_generation()
+
+
+# ---------- FRIEND TIMELINE ----------
+#
+# Optional fan-out-on-write copy of every user's depth-1 friend feed
+# (CIRCLE_FRIEND_TIMELINE=1). A row (reader, listing, created_at) exists
+# while the listing is published; writers keep it in the same transaction
+# as the listing/friendship change, and readers do one range scan of the
+# (user_id, created_at, listing_id) primary key instead of a join + sort.
+
+
+def _timeline_feed_query(after: str = "", limit: bool = False) -> str:
+    return f"""
         SELECT
             l.id,
             l.title,
@@ -577,113 +1110,216 @@ def get_all_listings():
             l.condition,
             l.retail_price,
             l.image_paths,
+            l.image_variants,
             l.status,
             u.display_name AS seller_name
-        FROM listings l
+        FROM friend_timeline t
+        JOIN listings l ON l.id = t.listing_id
         JOIN users u ON u.id = l.user_id
-        WHERE l.status IS NULL OR l.status = 'published'
-        ORDER BY l.created_at DESC
+        WHERE t.user_id = :user_id
+          AND l.status = 'published'
+          {after}
+        ORDER BY t.created_at DESC, t.listing_id DESC
+        {"LIMIT :limit" if limit else ""}
+    """
+
+
+def _timeline_fan_out(cur, *listing_ids: int):
+    """Push (re)published listings into every follower's timeline."""
+    cur.executemany(
         """
+        INSERT OR IGNORE INTO friend_timeline (user_id, listing_id, created_at)
+        SELECT f.user_id, l.id, l.created_at
+        FROM listings l
+        JOIN friendships f ON f.friend_user_id = l.user_id
+        WHERE l.id = ? AND l.status = 'published'
+        """,
+        [(listing_id,) for listing_id in listing_ids],
     )
-    rows = cur.fetchall()
-    conn.close()
-    return rows
 
 
-def delete_listing(user_id: int, listing_id: int) -> bool:
-    """Permanently delete a listing, only if it belongs to this user."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "DELETE FROM listings WHERE id = ? AND user_id = ?",
-        (listing_id, user_id),
+def _timeline_prune(cur, *listing_ids: int):
+    """Drop listings that are no longer published (or gone) from all timelines."""
+    cur.executemany(
+        """
+        DELETE FROM friend_timeline
+        WHERE listing_id = :id
+          AND NOT EXISTS (
+              SELECT 1 FROM listings WHERE id = :id AND status = 'published'
+          )
+        """,
+        [{"id": listing_id} for listing_id in listing_ids],
     )
-    deleted = cur.rowcount > 0
-    conn.commit()
-    conn.close()
-    return deleted
 
 
-def update_listing_status(user_id: int, listing_id: int, status: str) -> bool:
-    """Update a listing status (draft/published/inactive), only if it belongs to this user."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE listings SET status = ? WHERE id = ? AND user_id = ?",
-        (status, listing_id, user_id),
+def _timeline_follow(cur, *pairs):
+    """Backfill each new friend's published listings: pairs of (user_id, friend_user_id)."""
+    cur.executemany(
+        """
+        INSERT OR IGNORE INTO friend_timeline (user_id, listing_id, created_at)
+        SELECT ?, l.id, l.created_at
+        FROM listings l
+        WHERE l.user_id = ? AND l.status = 'published'
+        """,
+        pairs,
     )
-    updated = cur.rowcount > 0
-    conn.commit()
-    conn.close()
-    return updated
 
 
-# ---------- FRIENDSHIP HELPERS ----------
+def rebuild_friend_timeline() -> int:
+    """Recompute friend_timeline from scratch. Returns the row count."""
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM friend_timeline")
+        cur.execute(
+            """
+            INSERT INTO friend_timeline (user_id, listing_id, created_at)
+            SELECT f.user_id, l.id, l.created_at
+            FROM friendships f
+            JOIN listings l ON l.user_id = f.friend_user_id
+            WHERE l.status = 'published'
+            """
+        )
+        count = cur.rowcount
+    _bump_listings_generation()
+    return count
 
 
-def get_friend_ids(user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT friend_user_id FROM friendships WHERE user_id = ?",
-        (user_id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    return [r["friend_user_id"] for r in rows]
+# ---------- BULK WRITES ----------
+#
+# For imports, backfills and "do this to all my listings" actions: one
+# executemany in one transaction instead of one commit per row. They join
+# an enclosing unit_of_work() like every other helper.
 
 
-def get_friend_listings(user_id):
-    """Return *published* listings only from the user's friends."""
-    friend_ids = get_friend_ids(user_id)
-    if not friend_ids:
+def insert_listings_bulk(listings) -> list:
+    """
+    Insert many listings at once. listings: iterable of dicts with the
+    keyword arguments of insert_listing (user_id, title, description and
+    price required). Returns the new ids in input order.
+    """
+    listings = list(listings)
+    if not listings:
         return []
 
-    conn = get_connection()
-    cur = conn.cursor()
+    rows = [_listing_insert_params(**listing) for listing in listings]
+
+    with _db() as conn:
+        if not conn.in_transaction:
+            # Take the writer lock before the first row, not partway in
+            conn.execute("BEGIN IMMEDIATE")
+        cur = conn.cursor()
+        cur.executemany(_INSERT_LISTING_SQL, rows)
+        # AUTOINCREMENT hands out strictly increasing ids, and no other
+        # connection can insert while we hold the writer lock (until
+        # commit), so our rows are exactly the newest len(rows) ids
+        cur.execute("SELECT id FROM listings ORDER BY id DESC LIMIT ?", (len(rows),))
+        listing_ids = [r["id"] for r in reversed(cur.fetchall())]
+
+        _adjust_blob_refs(
+            cur,
+            [p for listing in listings for p in (listing.get("image_paths") or [])],
+            +1,
+        )
+        if FRIEND_TIMELINE_ENABLED:
+            _timeline_fan_out(cur, *listing_ids)
+    _bump_listings_generation()
+    return listing_ids
 
-    placeholders = ",".join("?" for _ in friend_ids)
-    query = f"""
-        SELECT
-            l.id,
-            l.title,
-            l.description,
-            l.price,
-            l.image_path,
-            l.created_at,
-            l.brand,
-            l.category,
-            l.condition,
-            l.retail_price,
-            l.image_paths,
-            l.status,
-            u.display_name AS seller_name
-        FROM listings l
-        JOIN users u ON u.id = l.user_id
-        WHERE l.user_id IN ({placeholders})
-          AND (l.status IS NULL OR l.status = 'published')
-        ORDER BY l.created_at DESC
+
+def update_listing_status_bulk(user_id: int, listing_ids, status: str) -> int:
     """
+    Set status on many of this user's listings (others are skipped).
+    Returns how many rows changed.
+    """
+    listing_ids = list(listing_ids)
+    if not listing_ids:
+        return 0
 
-    cur.execute(query, friend_ids)
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            "UPDATE listings SET status = ? WHERE id = ? AND user_id = ?",
+            [(status, listing_id, user_id) for listing_id in listing_ids],
+        )
+        updated = cur.rowcount
+        if updated and FRIEND_TIMELINE_ENABLED:
+            if status == "published":
+                _timeline_fan_out(cur, *listing_ids)
+            else:
+                _timeline_prune(cur, *listing_ids)
+    if updated:
+        _bump_listings_generation()
+    return updated
 
 
-def add_friend(user_id, friend_user_id):
-    """Create a friendship link if it doesn’t exist yet."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT OR IGNORE INTO friendships (user_id, friend_user_id)
-        VALUES (?, ?)
-        """,
-        (user_id, friend_user_id),
-    )
-    conn.commit()
-    conn.close()
+def add_friends_bulk(pairs) -> int:
+    """
+    Create many friendship links: pairs of (user_id, friend_user_id).
+    Existing links are ignored. Returns how many were new.
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return 0
+
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            """
+            INSERT OR IGNORE INTO friendships (user_id, friend_user_id)
+            VALUES (?, ?)
+            """,
+            pairs,
+        )
+        added = cur.rowcount
+        if added and FRIEND_TIMELINE_ENABLED:
+            _timeline_follow(cur, *pairs)
+    if added:
+        _bump_listings_generation()
+    return added
+
+
+# ---------- CART & LIKES ----------
+#
+# Persistent per-user id sets. Pages keep a set-backed mirror in session
+# state (core/user_sets.py) and write the accumulated changes here in one
+# transaction, instead of one commit per click.
+
+_ID_SET_TABLES = {
+    "cart": ("cart_items", "added_at"),
+    "likes": ("likes", "created_at"),
+}
+
+
+def get_user_set_ids(kind: str, user_id: int) -> list:
+    """Listing ids in a user's cart / likes, oldest first."""
+    table, stamp = _ID_SET_TABLES[kind]
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT listing_id FROM {table} WHERE user_id = ? ORDER BY {stamp}, listing_id",
+            (user_id,),
+        )
+        rows = cur.fetchall()
+    return [r["listing_id"] for r in rows]
+
+
+def save_user_set_changes(kind: str, user_id: int, added=(), removed=()):
+    """Apply batched adds/removes to a user's cart / likes in one transaction."""
+    table, _ = _ID_SET_TABLES[kind]
+    if not added and not removed:
+        return
+    with _db() as conn:
+        cur = conn.cursor()
+        if removed:
+            cur.executemany(
+                f"DELETE FROM {table} WHERE user_id = ? AND listing_id = ?",
+                [(user_id, listing_id) for listing_id in removed],
+            )
+        if added:
+            cur.executemany(
+                f"INSERT OR IGNORE INTO {table} (user_id, listing_id) VALUES (?, ?)",
+                [(user_id, listing_id) for listing_id in added],
+            )
 
 
 # ---------- INVITE HELPERS ----------
@@ -692,59 +1328,54 @@ def add_friend(user_id, friend_user_id):
 def create_invite_code(inviter_user_id: int) -> str:
     """Generate and store a new invite code for this user."""
     code = secrets.token_urlsafe(6)[:8]  # short, shareable
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO invites (inviter_user_id, code)
-        VALUES (?, ?)
-        """,
-        (inviter_user_id, code),
-    )
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO invites (inviter_user_id, code)
+            VALUES (?, ?)
+            """,
+            (inviter_user_id, code),
+        )
     return code
 
 
 def get_invite_codes_for_user(inviter_user_id: int):
     """Return all invite codes created by this user. Safe even if table is missing."""
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """
-            SELECT code, created_at
-            FROM invites
-            WHERE inviter_user_id = ?
-            ORDER BY created_at DESC
-            """,
-            (inviter_user_id,),
-        )
-        rows = cur.fetchall()
-    except sqlite3.OperationalError as e:
-        if "no such table" in str(e).lower():
-            rows = []
-        else:
-            raise
-    finally:
-        conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                SELECT code, created_at
+                FROM invites
+                WHERE inviter_user_id = ?
+                ORDER BY created_at DESC
+                """,
+                (inviter_user_id,),
+            )
+            rows = cur.fetchall()
+        except sqlite3.OperationalError as e:
+            if "no such table" in str(e).lower():
+                rows = []
+            else:
+                raise
     return rows
 
 
 def get_invite_by_code(code: str):
     """Return invite row for a given code, or None if invalid."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT id, inviter_user_id, code, created_at
-        FROM invites
-        WHERE code = ?
-        """,
-        (code,),
-    )
-    row = cur.fetchone()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, inviter_user_id, code, created_at
+            FROM invites
+            WHERE code = ?
+            """,
+            (code,),
+        )
+        row = cur.fetchone()
     return row
 
 
@@ -768,102 +1399,254 @@ def create_order(
     buyer_note: str,
 ) -> int:
     """Create a new order record and return its ID."""
-    conn = get_connection()
-    cur = conn.cursor()
+    with _db() as conn:
+        cur = conn.cursor()
 
-    cur.execute(
-        """
-        INSERT INTO orders (
-            buyer_id,
-            seller_id,
-            listing_id,
-            status,
-            total_price,
-            shipping_name,
-            shipping_address1,
-            shipping_address2,
-            shipping_city,
-            shipping_state,
-            shipping_postal_code,
-            shipping_country,
-            shipping_phone,
-            payment_method,
-            buyer_note
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            buyer_id,
-            seller_id,
-            listing_id,
-            "pending",           # status
-            total_price,
-            shipping_name,
-            shipping_address1,
-            shipping_address2,
-            shipping_city,
-            shipping_state,
-            shipping_postal_code,
-            shipping_country,
-            shipping_phone,
-            payment_method,
-            buyer_note,
-        ),
-    )
+        cur.execute(
+            """
+            INSERT INTO orders (
+                buyer_id,
+                seller_id,
+                listing_id,
+                status,
+                total_price,
+                shipping_name,
+                shipping_address1,
+                shipping_address2,
+                shipping_city,
+                shipping_state,
+                shipping_postal_code,
+                shipping_country,
+                shipping_phone,
+                payment_method,
+                buyer_note
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                buyer_id,
+                seller_id,
+                listing_id,
+                "pending",           # status
+                total_price,
+                shipping_name,
+                shipping_address1,
+                shipping_address2,
+                shipping_city,
+                shipping_state,
+                shipping_postal_code,
+                shipping_country,
+                shipping_phone,
+                payment_method,
+                buyer_note,
+            ),
+        )
 
-    conn.commit()
-    order_id = cur.lastrowid
-    conn.close()
+        order_id = cur.lastrowid
+    return order_id
+
+
+class CheckoutBusy(RuntimeError):
+    """The DB write lock could not be taken within busy_timeout (flash-sale load)."""
+
+
+def reserve_and_create_order(
+    buyer_id: int,
+    seller_id: int,
+    listing_id: int,
+    total_price: float,
+    shipping_name: str,
+    shipping_address1: str,
+    shipping_address2: str,
+    shipping_city: str,
+    shipping_state: str,
+    shipping_postal_code: str,
+    shipping_country: str,
+    shipping_phone: str,
+    payment_method: str,
+    buyer_note: str,
+):
+    """
+    Atomically reserve a published listing and create its pending order.
+
+    BEGIN IMMEDIATE takes the write lock up front, so two buyers racing on
+    the same item are serialized: the second one's conditional UPDATE
+    finds the listing no longer 'published'. Returns the new order ID,
+    or None if the listing was already taken (or isn't this seller's).
+    Raises CheckoutBusy if the lock can't be had within busy_timeout.
+    """
+    with unit_of_work() as conn:
+        if not conn.in_transaction:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                if "locked" in str(e) or "busy" in str(e):
+                    raise CheckoutBusy(str(e)) from e
+                raise
+
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE listings SET status = 'reserved'
+            WHERE id = ? AND user_id = ? AND status = 'published'
+            """,
+            (listing_id, seller_id),
+        )
+        if cur.rowcount == 0:
+            return None
+        if FRIEND_TIMELINE_ENABLED:
+            _timeline_prune(cur, listing_id)
+
+        order_id = create_order(
+            buyer_id=buyer_id,
+            seller_id=seller_id,
+            listing_id=listing_id,
+            total_price=total_price,
+            shipping_name=shipping_name,
+            shipping_address1=shipping_address1,
+            shipping_address2=shipping_address2,
+            shipping_city=shipping_city,
+            shipping_state=shipping_state,
+            shipping_postal_code=shipping_postal_code,
+            shipping_country=shipping_country,
+            shipping_phone=shipping_phone,
+            payment_method=payment_method,
+            buyer_note=buyer_note,
+        )
+        # Deferred until the unit of work commits
+        _bump_listings_generation()
     return order_id
 
 
 def get_orders_for_buyer(buyer_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT *
-        FROM orders
-        WHERE buyer_id = ?
-        ORDER BY created_at DESC
-        """,
-        (buyer_id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT *
+            FROM orders
+            WHERE buyer_id = ?
+            ORDER BY created_at DESC
+            """,
+            (buyer_id,),
+        )
+        rows = cur.fetchall()
     return rows
 
 
 def get_orders_for_seller(seller_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT *
-        FROM orders
-        WHERE seller_id = ?
-        ORDER BY created_at DESC
-        """,
-        (seller_id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT *
+            FROM orders
+            WHERE seller_id = ?
+            ORDER BY created_at DESC
+            """,
+            (seller_id,),
+        )
+        rows = cur.fetchall()
     return rows
 
 
 def update_order_status(order_id: int, status: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE orders
-        SET status = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-        """,
-        (status, order_id),
-    )
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE orders
+            SET status = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (status, order_id),
+        )
+
+
+def get_stale_stripe_reservations(
+    ttl_seconds: int, limit: int = 200, after: Optional[tuple] = None
+) -> list:
+    """
+    'pending' orders older than ttl_seconds that went through Stripe
+    Checkout, oldest first (idx_orders_status_created). Only these can be
+    checked for payment; manual (Zelle/PayPal/...) orders are left alone.
+    after: (created_at, id) of the last row of the previous page.
+    """
+    after_sql = ""
+    params = {"age": f"-{int(ttl_seconds)} seconds", "limit": limit}
+    if after is not None:
+        after_sql = "AND (created_at, id) > (:after_created_at, :after_id)"
+        params.update(after_created_at=after[0], after_id=after[1])
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            SELECT id, listing_id, stripe_session_id, created_at
+            FROM orders
+            WHERE status = 'pending'
+              AND created_at < datetime('now', :age)
+              AND stripe_session_id IS NOT NULL
+              {after_sql}
+            ORDER BY created_at, id
+            LIMIT :limit
+            """,
+            params,
+        )
+        return cur.fetchall()
+
+
+def expire_reservations(order_ids) -> dict:
+    """
+    Mark these (still 'pending') orders 'expired' and put their listings
+    back on sale, in one short transaction. Callers must have established
+    the orders were never paid (core.sweeper checks Stripe). A listing is
+    only re-published if no other order still holds it.
+    Returns {"orders": expired, "listings": released}.
+    """
+    order_ids = list(order_ids)
+    if not order_ids:
+        return {"orders": 0, "listings": 0}
+
+    with _db() as conn:
+        cur = conn.cursor()
+        placeholders = ",".join("?" * len(order_ids))
+        cur.execute(
+            f"SELECT DISTINCT listing_id FROM orders "
+            f"WHERE status = 'pending' AND id IN ({placeholders})",
+            order_ids,
+        )
+        listing_ids = [r["listing_id"] for r in cur.fetchall()]
+
+        cur.executemany(
+            """
+            UPDATE orders
+            SET status = 'expired', updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'pending'
+            """,
+            [(order_id,) for order_id in order_ids],
+        )
+        expired = cur.rowcount
+
+        cur.executemany(
+            """
+            UPDATE listings SET status = 'published'
+            WHERE id = :id
+              AND status = 'reserved'
+              AND NOT EXISTS (
+                  SELECT 1 FROM orders
+                  WHERE listing_id = :id
+                    AND status NOT IN ('expired', 'cancelled')
+              )
+            """,
+            [{"id": listing_id} for listing_id in listing_ids],
+        )
+        released = cur.rowcount
+        if released and FRIEND_TIMELINE_ENABLED:
+            _timeline_fan_out(cur, *listing_ids)
+
+    if released:
+        _bump_listings_generation()
+    return {"orders": expired, "listings": released}
 
 
 def update_order_stripe_info(
@@ -875,20 +1658,18 @@ def update_order_stripe_info(
     Attach Stripe checkout/payment info to an order.
     We fill payment_intent_id later on success.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE orders
-        SET stripe_session_id = ?,
-            stripe_payment_intent_id = ?,
-            updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-        """,
-        (stripe_session_id, stripe_payment_intent_id, order_id),
-    )
-    conn.commit()
-    conn.close()
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE orders
+            SET stripe_session_id = ?,
+                stripe_payment_intent_id = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (stripe_session_id, stripe_payment_intent_id, order_id),
+        )
 
 
 def update_order_shipping(
@@ -897,18 +1678,98 @@ def update_order_shipping(
     carrier: str,
     estimated_delivery_date: str,
 ):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            UPDATE orders
+            SET tracking_number = ?,
+                carrier = ?,
+                estimated_delivery_date = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (tracking_number, carrier, estimated_delivery_date, order_id),
+        )
+
+
+# ---------- UPLOAD BLOB HELPERS ----------
+#
+# Uploaded files live in a content-addressed store (core/storage.py).
+# blobs.refcount counts how many listing images / profile photos point at
+# each one; the writes above adjust it in the same transaction.
+
+
+def _adjust_blob_refs(cur, paths, delta: int):
+    """Add delta to the refcount of every blob-store path in paths."""
+    digests = [storage.blob_digest_from_path(p) for p in paths]
+    digests = [d for d in digests if d]
+    if not digests:
+        return
+    cur.executemany(
         """
-        UPDATE orders
-        SET tracking_number = ?,
-            carrier = ?,
-            estimated_delivery_date = ?,
+        INSERT INTO blobs (digest, refcount)
+        VALUES (?, ?)
+        ON CONFLICT(digest) DO UPDATE
+        SET refcount = refcount + excluded.refcount,
             updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
         """,
-        (tracking_number, carrier, estimated_delivery_date, order_id),
+        [(d, delta) for d in digests],
     )
-    conn.commit()
-    conn.close()
+
+
+def gc_orphan_blobs(grace_seconds: int = 24 * 3600) -> dict:
+    """
+    Delete uploads nobody references any more:
+      1) blobs whose refcount dropped to 0 at least grace_seconds ago
+      2) files on disk with no blobs row at all (uploaded, then the
+         listing was never saved) older than grace_seconds
+    The grace period keeps in-flight uploads safe. Run periodically by
+    core.blob_gc (started from app.py). Returns counts of what was removed.
+    """
+    removed_blobs = 0
+    removed_files = 0
+
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT digest FROM blobs
+            WHERE refcount <= 0
+              AND updated_at < datetime('now', ?)
+            """,
+            (f"-{int(grace_seconds)} seconds",),
+        )
+        candidates = [r["digest"] for r in cur.fetchall()]
+
+    for digest in candidates:
+        with _db() as conn:
+            cur = conn.cursor()
+            # Re-check: it may have been referenced again meanwhile
+            cur.execute(
+                "DELETE FROM blobs WHERE digest = ? AND refcount <= 0",
+                (digest,),
+            )
+            if cur.rowcount == 0:
+                continue
+        removed_blobs += 1
+        removed_files += storage.delete_blob_files(digest)
+
+    # Files with no row at all
+    with _db() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT digest FROM blobs")
+        known = {r["digest"] for r in cur.fetchall()}
+
+    cutoff = time.time() - grace_seconds
+    for digest, path in storage.iter_blob_files():
+        if digest in known:
+            continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed_files += 1
+        except FileNotFoundError:
+            pass
+
+    return {"blobs": removed_blobs, "files": removed_files}
@@ -0,0 +1,87 @@
+# core/listing_view.py
+"""
+Read-only, pre-decoded view of a listing row for the Streamlit pages.
+
+Feed/cart helpers in core.db wrap their rows in ListingView once, at load
+time (and the feed cache keeps the wrapped rows), so render loops read
+plain attributes instead of re-parsing image_paths / image_variants JSON
+and rebuilding meta/price strings on every rerun.
+
+row["column"] access keeps working for anything not pre-computed.
+"""
+import json
+
+from .storage import pick_image_variant
+
+
+def _json_list(raw):
+    if not raw:
+        return []
+    try:
+        loaded = json.loads(raw)
+    except (TypeError, ValueError):
+        return []
+    return loaded if isinstance(loaded, list) else []
+
+
+def _money(value):
+    return f"${float(value):.0f}"
+
+
+class ListingView:
+    __slots__ = (
+        "_row",
+        "id",
+        "title",
+        "description",
+        "created_at",
+        "seller_name",
+        "price",
+        "price_label",
+        "retail_label",
+        "meta",
+        "images",
+        "variants",
+        "like_count",
+    )
+
+    def __init__(self, row):
+        self._row = row
+        self.id = row["id"]
+        self.title = row["title"]
+        self.description = row["description"]
+        self.created_at = row["created_at"]
+        self.seller_name = row["seller_name"] or "Unknown"
+
+        self.price = float(row["price"])
+        self.price_label = _money(row["price"])
+        self.retail_label = (
+            _money(row["retail_price"]) if row["retail_price"] is not None else None
+        )
+
+        bits = [str(row[k]) for k in ("brand", "category", "condition") if row[k]]
+        self.meta = " · ".join(bits) if bits else None
+
+        # Fallback to the single image_path for older listings
+        images = [p for p in _json_list(row["image_paths"]) if p]
+        if not images and row["image_path"]:
+            images = [row["image_path"]]
+        self.images = tuple(images)
+        self.variants = tuple(_json_list(row["image_variants"]))
+
+        # Only the popular feed selects it
+        self.like_count = row["like_count"] if "like_count" in row.keys() else None
+
+    def __getitem__(self, key):
+        return self._row[key]
+
+    def keys(self):
+        return self._row.keys()
+
+    def __repr__(self):
+        return f"<ListingView id={self.id} title={self.title!r}>"
+
+    def image(self, idx: int, width: int):
+        """Smallest stored variant of image #idx that still fits `width`."""
+        variant = self.variants[idx] if idx < len(self.variants) else None
+        return pick_image_variant(variant, self.images[idx], width)
@@ -0,0 +1,523 @@
+# core/migrations.py
+"""
+Versioned schema migrations for circle.db.
+
+The schema version lives in the DB header (PRAGMA user_version), so
+checking "is the schema current?" is a single cheap read and no DDL runs
+at all once a DB is up to date. Each migration runs in its own
+BEGIN IMMEDIATE transaction together with the version bump, so two
+processes starting at once can't both apply it.
+
+To change the schema, append a new Migration to MIGRATIONS — never edit
+one that has already shipped.
+"""
+import sqlite3
+from typing import Callable, List, NamedTuple
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection], None]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _set_schema_version(conn: sqlite3.Connection, version: int):
+    # PRAGMA doesn't take bound parameters; version is always our own int
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+
+
+def add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, column_def: str):
+    """ALTER TABLE ... ADD COLUMN, but only when the column isn't there yet."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in existing:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_def}")
+
+
+def migrate(conn: sqlite3.Connection, migrations: List[Migration]) -> List[int]:
+    """
+    Apply every migration newer than the DB's user_version, in order.
+    Returns the list of versions applied (empty if already current).
+    """
+    latest = migrations[-1].version if migrations else 0
+    if get_schema_version(conn) >= latest:
+        return []
+
+    if conn.in_transaction:
+        conn.commit()
+
+    applied = []
+    for migration in migrations:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-check under the write lock: another process may have won
+            if get_schema_version(conn) >= migration.version:
+                conn.rollback()
+                continue
+            migration.apply(conn)
+            _set_schema_version(conn, migration.version)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append(migration.version)
+    return applied
+
+
+# ---------------- circle.db (core) migrations ----------------
+
+
+def _v1_base_schema(conn: sqlite3.Connection):
+    """Tables as they existed before versioning, plus legacy column upgrades."""
+    # ---------------- USERS ----------------
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            display_name TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            phone TEXT,
+            inviter_name TEXT,
+            password_hash TEXT,
+            profile_image_path TEXT,
+            invited_by_user_id INTEGER,
+            stripe_account_id TEXT,
+            stripe_onboarded INTEGER DEFAULT 0,
+            FOREIGN KEY (invited_by_user_id) REFERENCES users(id)
+        )
+        """
+    )
+
+    # ---------------- LISTINGS ----------------
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS listings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            price REAL NOT NULL,
+            image_path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            brand TEXT,
+            category TEXT,
+            condition TEXT,
+            retail_price REAL,
+            image_paths TEXT,
+            status TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """
+    )
+
+    # ---------------- FRIENDSHIPS ----------------
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS friendships (
+            user_id INTEGER NOT NULL,
+            friend_user_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, friend_user_id),
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (friend_user_id) REFERENCES users(id)
+        )
+        """
+    )
+
+    # ---------------- INVITES ----------------
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS invites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            inviter_user_id INTEGER NOT NULL,
+            code TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (inviter_user_id) REFERENCES users(id)
+        )
+        """
+    )
+
+    # ---------------- ORDERS ----------------
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            buyer_id INTEGER NOT NULL,
+            seller_id INTEGER NOT NULL,
+            listing_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            total_price REAL NOT NULL,
+            shipping_name TEXT,
+            shipping_address1 TEXT,
+            shipping_address2 TEXT,
+            shipping_city TEXT,
+            shipping_state TEXT,
+            shipping_postal_code TEXT,
+            shipping_country TEXT,
+            shipping_phone TEXT,
+            payment_method TEXT,
+            buyer_note TEXT,
+            tracking_number TEXT,
+            carrier TEXT,
+            estimated_delivery_date TEXT,
+            stripe_session_id TEXT,
+            stripe_payment_intent_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (buyer_id) REFERENCES users(id),
+            FOREIGN KEY (seller_id) REFERENCES users(id),
+            FOREIGN KEY (listing_id) REFERENCES listings(id)
+        )
+        """
+    )
+
+    # ---- DBs created before these columns existed ----
+    for col, col_def in [
+        ("first_name", "TEXT"),
+        ("last_name", "TEXT"),
+        ("phone", "TEXT"),
+        ("inviter_name", "TEXT"),
+        ("password_hash", "TEXT"),
+        ("profile_image_path", "TEXT"),
+        ("invited_by_user_id", "INTEGER"),
+        ("stripe_account_id", "TEXT"),
+        ("stripe_onboarded", "INTEGER DEFAULT 0"),
+    ]:
+        add_column_if_missing(conn, "users", col, col_def)
+
+    for col, col_def in [
+        ("brand", "TEXT"),
+        ("category", "TEXT"),
+        ("condition", "TEXT"),
+        ("retail_price", "REAL"),
+        ("image_paths", "TEXT"),
+        ("status", "TEXT"),  # e.g. 'draft', 'published', 'inactive'
+    ]:
+        add_column_if_missing(conn, "listings", col, col_def)
+
+    for col, col_def in [
+        ("tracking_number", "TEXT"),
+        ("carrier", "TEXT"),
+        ("estimated_delivery_date", "TEXT"),
+        ("stripe_session_id", "TEXT"),
+        ("stripe_payment_intent_id", "TEXT"),
+    ]:
+        add_column_if_missing(conn, "orders", col, col_def)
+
+
+def _v2_secondary_indexes(conn: sqlite3.Connection):
+    """Indexes matching the WHERE / ORDER BY shapes used in core/db.py."""
+    # Old rows may have NULL status (= published). Backfill so feed queries
+    # can use a plain `status = 'published'` and walk the index below.
+    conn.execute("UPDATE listings SET status = 'published' WHERE status IS NULL")
+
+    for stmt in [
+        # get_all_listings / get_friend_listings: status filter + newest first
+        "CREATE INDEX IF NOT EXISTS idx_listings_status_created "
+        "ON listings(status, created_at DESC)",
+        # get_listings_for_user and friend feeds: by seller, newest first
+        "CREATE INDEX IF NOT EXISTS idx_listings_user_created "
+        "ON listings(user_id, created_at DESC)",
+        # get_orders_for_buyer / get_orders_for_seller
+        "CREATE INDEX IF NOT EXISTS idx_orders_buyer_created "
+        "ON orders(buyer_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_orders_seller_created "
+        "ON orders(seller_id, created_at DESC)",
+        # Reverse friendship lookups (friendships(user_id, ...) is the PK)
+        "CREATE INDEX IF NOT EXISTS idx_friendships_friend "
+        "ON friendships(friend_user_id)",
+        # get_invite_codes_for_user (invites.code is already UNIQUE-indexed)
+        "CREATE INDEX IF NOT EXISTS idx_invites_inviter_created "
+        "ON invites(inviter_user_id, created_at DESC)",
+        # get_users_invited_by
+        "CREATE INDEX IF NOT EXISTS idx_users_invited_by "
+        "ON users(invited_by_user_id)",
+    ]:
+        conn.execute(stmt)
+
+
+def _v3_keyset_feed_indexes(conn: sqlite3.Connection):
+    """
+    Feeds page on (created_at, id) newest-first. Put id in the index (in
+    ascending order, scanned backwards) so ORDER BY created_at DESC, id DESC
+    needs no temp B-tree sort.
+    """
+    conn.execute("DROP INDEX IF EXISTS idx_listings_status_created")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_listings_status_created_id "
+        "ON listings(status, created_at, id)"
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_listings_user_created")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_listings_user_created_id "
+        "ON listings(user_id, created_at, id)"
+    )
+
+
+def _v4_listings_fts(conn: sqlite3.Connection):
+    """
+    FTS5 index over the searchable listing text (plus seller name), kept in
+    sync by triggers on listings and users. rowid = listings.id.
+    """
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5(
+            title, brand, category, condition, description, seller_name,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        """
+    )
+
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS listings_fts_ai AFTER INSERT ON listings
+        BEGIN
+            INSERT INTO listings_fts (
+                rowid, title, brand, category, condition, description, seller_name
+            )
+            VALUES (
+                new.id, new.title, new.brand, new.category, new.condition,
+                new.description,
+                (SELECT display_name FROM users WHERE id = new.user_id)
+            );
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS listings_fts_ad AFTER DELETE ON listings
+        BEGIN
+            DELETE FROM listings_fts WHERE rowid = old.id;
+        END
+        """
+    )
+    # Status changes don't touch the text, so only fire on the columns we index
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS listings_fts_au
+        AFTER UPDATE OF title, brand, category, condition, description, user_id
+        ON listings
+        BEGIN
+            UPDATE listings_fts
+            SET title = new.title,
+                brand = new.brand,
+                category = new.category,
+                condition = new.condition,
+                description = new.description,
+                seller_name = (SELECT display_name FROM users WHERE id = new.user_id)
+            WHERE rowid = new.id;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF display_name ON users
+        BEGIN
+            UPDATE listings_fts
+            SET seller_name = new.display_name
+            WHERE rowid IN (SELECT id FROM listings WHERE user_id = new.id);
+        END
+        """
+    )
+
+    # Backfill existing listings
+    conn.execute("DELETE FROM listings_fts")
+    conn.execute(
+        """
+        INSERT INTO listings_fts (
+            rowid, title, brand, category, condition, description, seller_name
+        )
+        SELECT l.id, l.title, l.brand, l.category, l.condition, l.description,
+               u.display_name
+        FROM listings l
+        LEFT JOIN users u ON u.id = l.user_id
+        """
+    )
+
+
+def _v5_listing_image_variants(conn: sqlite3.Connection):
+    """JSON list of resized copies ({variant: path}) parallel to image_paths."""
+    add_column_if_missing(conn, "listings", "image_variants", "TEXT")
+
+
+def _v6_blob_refcounts(conn: sqlite3.Connection):
+    """Refcounts for content-addressed uploads (see core/storage.py)."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+            digest TEXT PRIMARY KEY,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        """
+    )
+    # The GC sweep only ever looks at unreferenced blobs
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced "
+        "ON blobs(updated_at) WHERE refcount <= 0"
+    )
+
+
+def _v7_friend_timeline(conn: sqlite3.Connection):
+    """
+    Materialized friend feed: one row per (reader, friend's published
+    listing). Filled by core.db only when FRIEND_TIMELINE_ENABLED is set.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS friend_timeline (
+            user_id INTEGER NOT NULL,
+            listing_id INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (user_id, created_at, listing_id)
+        ) WITHOUT ROWID
+        """
+    )
+    # Pruning when a listing is reserved / deactivated / deleted
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_friend_timeline_listing "
+        "ON friend_timeline(listing_id)"
+    )
+
+
+def _v8_pending_order_index(conn: sqlite3.Connection):
+    """Reservation sweeper: oldest pending orders first (see core/sweeper.py)."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_created "
+        "ON orders(status, created_at)"
+    )
+
+
+def _v9_cart_and_likes(conn: sqlite3.Connection):
+    """Server-side carts and likes (were per-session lists before)."""
+    for table, stamp in (("cart_items", "added_at"), ("likes", "created_at")):
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id INTEGER NOT NULL,
+                listing_id INTEGER NOT NULL,
+                {stamp} TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, listing_id)
+            ) WITHOUT ROWID
+            """
+        )
+
+
+def _v10_listing_stats(conn: sqlite3.Connection):
+    """
+    Denormalized per-listing counters, kept by triggers on likes so the
+    "Popular" feed is an index walk instead of COUNT(*) ... GROUP BY.
+    Every listing gets a row (0 likes) so that walk covers all of them.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS listing_stats (
+            listing_id INTEGER PRIMARY KEY,
+            like_count INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_listing_stats_likes "
+        "ON listing_stats(like_count, listing_id)"
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS listing_stats_listing_ai AFTER INSERT ON listings
+        BEGIN
+            INSERT OR IGNORE INTO listing_stats (listing_id) VALUES (new.id);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS listing_stats_listing_ad AFTER DELETE ON listings
+        BEGIN
+            DELETE FROM listing_stats WHERE listing_id = old.id;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS listing_stats_like_ai AFTER INSERT ON likes
+        BEGIN
+            INSERT INTO listing_stats (listing_id, like_count)
+            VALUES (new.listing_id, 1)
+            ON CONFLICT(listing_id) DO UPDATE SET like_count = like_count + 1;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS listing_stats_like_ad AFTER DELETE ON likes
+        BEGIN
+            UPDATE listing_stats SET like_count = like_count - 1
+            WHERE listing_id = old.listing_id;
+        END
+        """
+    )
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO listing_stats (listing_id, like_count)
+        SELECT l.id, (SELECT COUNT(*) FROM likes k WHERE k.listing_id = l.id)
+        FROM listings l
+        """
+    )
+
+
+def _v11_feed_generation(conn: sqlite3.Connection):
+    # A DB-wide counter of feed-visible writes, bumped by triggers so that
+    # writes from any process (backend, core.sweeper, a second Streamlit
+    # worker) invalidate every process's feed cache (core.db FEED CACHE)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS feed_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO feed_generation (id, value) VALUES (1, 0)")
+    bump = "UPDATE feed_generation SET value = value + 1 WHERE id = 1;"
+    for name, event in [
+        ("feed_generation_listing_ai", "AFTER INSERT ON listings"),
+        ("feed_generation_listing_au", "AFTER UPDATE ON listings"),
+        ("feed_generation_listing_ad", "AFTER DELETE ON listings"),
+        ("feed_generation_friendship_ai", "AFTER INSERT ON friendships"),
+        ("feed_generation_friendship_ad", "AFTER DELETE ON friendships"),
+        # Feeds show the seller's display name
+        ("feed_generation_user_au", "AFTER UPDATE OF display_name ON users"),
+    ]:
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {bump} END")
+
+
+def _v12_order_listing_index(conn: sqlite3.Connection):
+    """Releasing a reservation checks the listing's other orders (expire_reservations)."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_listing_status "
+        "ON orders(listing_id, status)"
+    )
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "base schema", _v1_base_schema),
+    Migration(2, "secondary indexes", _v2_secondary_indexes),
+    Migration(3, "keyset feed indexes", _v3_keyset_feed_indexes),
+    Migration(4, "listings full-text search", _v4_listings_fts),
+    Migration(5, "listing image variants", _v5_listing_image_variants),
+    Migration(6, "blob refcounts", _v6_blob_refcounts),
+    Migration(7, "friend timeline", _v7_friend_timeline),
+    Migration(8, "pending order index", _v8_pending_order_index),
+    Migration(9, "cart items and likes", _v9_cart_and_likes),
+    Migration(10, "listing like counters", _v10_listing_stats),
+    Migration(11, "feed cache generation", _v11_feed_generation),
+    Migration(12, "order listing index", _v12_order_listing_index),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
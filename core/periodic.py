@@ -0,0 +1,96 @@
+# core/periodic.py
+"""
+Shared scaffolding for the background daemon threads (WAL checkpoints,
+reservation sweeps, blob GC, the backend's mail outbox).
+
+A subclass implements run_once(); PeriodicWorker calls it every
+interval_seconds on a daemon thread. A pass that raises is logged and
+kept in last_error, and the thread carries on with the next interval –
+one bad pass (a locked DB, a pool timeout, a bug) must not silently
+stop the job for the rest of the process's life.
+"""
+import logging
+import threading
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+
+class PeriodicWorker:
+    """Daemon thread that calls self.run_once() on an interval."""
+
+    # Used for the thread name and log lines
+    name = "periodic-worker"
+    # Run a pass as soon as the thread starts, instead of after one interval
+    run_on_start = False
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    # ----- for subclasses -----
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def more_pending(self, result) -> bool:
+        """True to start the next pass right away (e.g. a full batch)."""
+        return False
+
+    def on_idle(self):
+        """Called before each wait between passes."""
+
+    def on_stop(self):
+        """Called on the worker thread when it exits."""
+
+    # ----- loop -----
+
+    def _pass(self) -> bool:
+        try:
+            result = self.run_once()
+        except Exception as e:
+            self.errors += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            log.exception("%s pass failed", self.name)
+            return False
+        self.last_error = None
+        return self.more_pending(result)
+
+    def _sleep(self):
+        self.on_idle()
+        self._wake.wait(self.interval_seconds)
+        self._wake.clear()
+
+    def _loop(self):
+        try:
+            if not self.run_on_start:
+                self._sleep()
+            while not self._stop.is_set():
+                if not self._pass():
+                    self._sleep()
+        finally:
+            self.on_stop()
+
+    def wake(self):
+        """Run the next pass now instead of at the end of the interval."""
+        self._wake.set()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def is_alive(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
@@ -0,0 +1,185 @@
+# core/pool.py
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from .sqlite_config import connect
+
+
+class ConnectionPool:
+    """
+    Small bounded pool of SQLite connections.
+
+    Connections are opened lazily (up to max_size) through
+    core.sqlite_config.connect (PRAGMAs, row factory, statement cache),
+    given any extra setup via on_connect, and then reused across helpers
+    and threads. Use it as:
+
+        with pool.connection() as conn:
+            conn.execute(...)
+
+    The block commits on success and rolls back on error before the
+    connection goes back into the pool.
+    """
+
+    def __init__(
+        self,
+        db_path,
+        max_size: int = 8,
+        timeout: float = 10.0,
+        idle_check_seconds: float = 30.0,
+        on_connect: Optional[Callable[[sqlite3.Connection], None]] = None,
+    ):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_check_seconds = idle_check_seconds
+        self.on_connect = on_connect
+
+        # LIFO so the warmest connection (page cache, prepared statements)
+        # is handed out first.
+        self._idle = queue.LifoQueue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._size = 0
+        self._last_used = {}
+
+        self._metrics = {
+            "created": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "discarded": 0,
+            "failed_health_checks": 0,
+        }
+
+    # ----------------- internals -----------------
+
+    def _count(self, name: str):
+        with self._lock:
+            self._metrics[name] += 1
+
+    def _open(self) -> sqlite3.Connection:
+        conn = connect(self.db_path, check_same_thread=False)
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        self._count("created")
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._size -= 1
+            self._last_used.pop(id(conn), None)
+        self._count("discarded")
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            self._count("failed_health_checks")
+            return False
+
+    def _acquire(self) -> sqlite3.Connection:
+        # 1) Reuse an idle connection if there is one
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+
+        # 2) Otherwise open a new one if we are still under max_size
+        if conn is None:
+            with self._lock:
+                can_open = self._size < self.max_size
+                if can_open:
+                    self._size += 1
+            if can_open:
+                try:
+                    return self._open()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                    raise
+
+            # 3) Pool exhausted: wait for someone to give one back
+            self._count("waits")
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(
+                    f"Timed out after {self.timeout}s waiting for a DB connection"
+                )
+
+        # Connections that sat idle for a while get a cheap liveness probe
+        idle_for = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if idle_for > self.idle_check_seconds and not self._is_healthy(conn):
+            self._discard(conn)
+            return self._acquire()
+
+        return conn
+
+    def _release(self, conn: sqlite3.Connection):
+        self._last_used[id(conn)] = time.monotonic()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+
+    # ----------------- public API -----------------
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection; commit on success, roll back on error."""
+        conn = self._acquire()
+        self._count("checkouts")
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                # Connection is in a bad state; don't hand it out again
+                self._discard(conn)
+            else:
+                self._release(conn)
+            raise
+        else:
+            self._release(conn)
+
+    def health_check(self) -> bool:
+        """Check out a connection and make sure it can run a query."""
+        try:
+            with self.connection() as conn:
+                return self._is_healthy(conn)
+        except Exception:
+            return False
+
+    def stats(self) -> dict:
+        """Return a snapshot of pool metrics."""
+        with self._lock:
+            size = self._size
+            metrics = dict(self._metrics)
+        idle = self._idle.qsize()
+        return {
+            **metrics,
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "max_size": self.max_size,
+        }
+
+    def close_all(self):
+        """Close every idle connection (e.g. on shutdown or in tests)."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
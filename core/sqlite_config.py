@@ -0,0 +1,158 @@
+# core/sqlite_config.py
+"""
+Shared SQLite storage settings for both the Streamlit app (core/db.py)
+and the FastAPI backend (backend/db.py).
+
+- WAL journal so readers don't block the writer (and vice versa)
+- synchronous=NORMAL, a bigger page cache and mmap for faster reads
+- busy_timeout so concurrent writers wait instead of failing with
+  "database is locked"
+- a background checkpoint scheduler so the -wal file doesn't grow forever
+"""
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+from .periodic import PeriodicWorker
+
+# How long a connection waits on a locked database before giving up (ms)
+BUSY_TIMEOUT_MS = int(os.getenv("CIRCLE_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Negative cache_size is in KiB (so -20000 ≈ 20 MB per connection)
+CACHE_SIZE_KIB = int(os.getenv("CIRCLE_SQLITE_CACHE_KIB", "20000"))
+
+# Memory-mapped I/O window (bytes)
+MMAP_SIZE = int(os.getenv("CIRCLE_SQLITE_MMAP_SIZE", str(128 * 1024 * 1024)))
+
+# Compiled statements kept per connection (sqlite3's default is 128); a hit
+# skips re-parsing / re-planning a query whose SQL text we've run before
+STATEMENT_CACHE_SIZE = int(os.getenv("CIRCLE_SQLITE_STATEMENT_CACHE", "256"))
+
+# Checkpoint scheduler defaults
+CHECKPOINT_INTERVAL_SECONDS = float(os.getenv("CIRCLE_SQLITE_CHECKPOINT_SECONDS", "60"))
+WAL_TRUNCATE_BYTES = int(os.getenv("CIRCLE_SQLITE_WAL_TRUNCATE_BYTES", str(64 * 1024 * 1024)))
+
+
+def configure_connection(conn: sqlite3.Connection):
+    """Apply our PRAGMAs to a freshly opened connection."""
+    # busy_timeout first, so switching to WAL can itself wait on a lock
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # journal_mode is persistent in the DB file; this is a no-op once set
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+
+def connect(db_path, check_same_thread: bool = False) -> sqlite3.Connection:
+    """Open a tuned SQLite connection with Row dict-like access."""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=BUSY_TIMEOUT_MS / 1000.0,
+        check_same_thread=check_same_thread,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.row_factory = sqlite3.Row
+    configure_connection(conn)
+    return conn
+
+
+def wal_size_bytes(db_path) -> int:
+    """Current size of the -wal file for this DB (0 if there is none)."""
+    try:
+        return os.path.getsize(f"{db_path}-wal")
+    except OSError:
+        return 0
+
+
+def checkpoint(conn: sqlite3.Connection, mode: str = "PASSIVE") -> dict:
+    """
+    Run a WAL checkpoint. mode: PASSIVE, FULL, RESTART or TRUNCATE.
+    Returns SQLite's (busy, wal pages, checkpointed pages) as a dict.
+    """
+    mode = mode.upper()
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        raise ValueError(f"Unknown checkpoint mode: {mode}")
+    busy, log_pages, checkpointed = conn.execute(
+        f"PRAGMA wal_checkpoint({mode})"
+    ).fetchone()
+    return {"busy": busy, "log_pages": log_pages, "checkpointed": checkpointed}
+
+
+def storage_report(db_path) -> dict:
+    """Small status dict for health endpoints / admin views."""
+    conn = connect(db_path)
+    try:
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        "journal_mode": journal_mode,
+        "db_bytes": page_count * page_size,
+        "wal_bytes": wal_size_bytes(db_path),
+    }
+
+
+class CheckpointScheduler(PeriodicWorker):
+    """
+    Daemon thread that checkpoints a DB's WAL on a fixed interval.
+
+    SQLite auto-checkpoints too, but only from a committing writer and
+    never while a long reader holds the WAL, so a PASSIVE pass here keeps
+    the file small; once it grows past truncate_bytes we TRUNCATE it.
+    """
+
+    def __init__(
+        self,
+        db_path,
+        interval_seconds: float = CHECKPOINT_INTERVAL_SECONDS,
+        truncate_bytes: int = WAL_TRUNCATE_BYTES,
+    ):
+        super().__init__(interval_seconds)
+        self.name = f"wal-checkpoint:{db_path}"
+        self.db_path = db_path
+        self.truncate_bytes = truncate_bytes
+        self.runs = 0
+        self.last_result: Optional[dict] = None
+
+    def run_once(self) -> dict:
+        mode = "TRUNCATE" if wal_size_bytes(self.db_path) > self.truncate_bytes else "PASSIVE"
+        conn = connect(self.db_path)
+        try:
+            result = checkpoint(conn, mode)
+        finally:
+            conn.close()
+        result["mode"] = mode
+        result["wal_bytes"] = wal_size_bytes(self.db_path)
+        self.runs += 1
+        self.last_result = result
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "errors": self.errors,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+            "wal_bytes": wal_size_bytes(self.db_path),
+        }
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def start_checkpoint_scheduler(db_path, **kwargs) -> CheckpointScheduler:
+    """Start (once per DB file per process) and return the checkpoint scheduler."""
+    key = os.path.abspath(str(db_path))
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = CheckpointScheduler(db_path, **kwargs)
+            _schedulers[key] = scheduler
+        scheduler.start()
+    return scheduler
@@ -1,8 +1,62 @@
 # core/storage.py
+import hashlib
+import io
 import os
-import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from .config import UPLOAD_DIR
-from typing import Optional
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# Pillow ships with Streamlit, but don't crash uploads if it's missing –
+# we just skip resizing and pages fall back to the original file.
+try:
+    from PIL import Image, ImageOps, features  # type: ignore
+except ImportError:
+    Image = None
+
+# What a bad / hostile image can make Pillow raise while decoding.
+# DecompressionBombError ("this 24 KB PNG is 200 megapixels") is a plain
+# Exception, not an OSError.
+if Image is not None:
+    IMAGE_DECODE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+else:
+    IMAGE_DECODE_ERRORS = (OSError, ValueError)
+
+
+# Resized copies generated at upload time: name -> longest edge in px.
+# Pages show photos at ~160–220 px (thumb), detail views go bigger.
+IMAGE_VARIANTS = {
+    "thumb": 240,
+    "card": 480,
+    "detail": 1280,
+}
+
+if Image is not None and features.check("webp"):
+    VARIANT_FORMAT, VARIANT_EXT = "WEBP", ".webp"
+else:
+    VARIANT_FORMAT, VARIANT_EXT = "JPEG", ".jpg"
+
+VARIANT_QUALITY = 82
+
+# Upload limits. Streamlit's own server.maxUploadSize (.streamlit/config.toml)
+# rejects oversized files before they are buffered; these are re-checked
+# here so other callers get the same rules.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("CIRCLE_MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+MAX_REQUEST_UPLOAD_BYTES = int(
+    os.getenv("CIRCLE_MAX_REQUEST_UPLOAD_BYTES", str(60 * 1024 * 1024))
+)
+
+# Magic bytes -> extension for the image types we accept
+_IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+]
+
+
+class UploadRejected(ValueError):
+    """An upload was too big or isn't an image type we accept."""
 
 
 def _ensure_upload_dir(subdir: Optional[str]=None) -> str:
@@ -13,23 +67,383 @@ def _ensure_upload_dir(subdir: Optional[str]=None) -> str:
     return base
 
 
+# ---------- Content-addressed blob store ----------
+#
+# Uploads are stored once per distinct content, named by the SHA-256 of
+# their bytes and sharded two levels deep so no directory gets huge:
+#
+#   uploads/blobs/ab/cd/abcd1234…ef.jpg        (original)
+#   uploads/blobs/ab/cd/abcd1234…ef_thumb.webp (variants)
+#
+# Same photo uploaded twice -> same file; seven photos in the same second
+# -> seven different names. Which blobs are still in use is tracked by
+# refcounts in the DB (see core.db blob helpers / gc_orphan_blobs).
+
+BLOB_SUBDIR = "blobs"
+
+
+def _blob_root() -> str:
+    return os.path.join(UPLOAD_DIR, BLOB_SUBDIR)
+
+
+def blob_dir(digest: str) -> str:
+    return os.path.join(_blob_root(), digest[:2], digest[2:4])
+
+
+def blob_path(digest: str, ext: str) -> str:
+    return os.path.join(blob_dir(digest), f"{digest}{ext}")
+
+
+def blob_digest_from_path(path: Optional[str]) -> Optional[str]:
+    """SHA-256 digest a blob-store path was named after, or None."""
+    if not path:
+        return None
+    root = os.path.abspath(_blob_root())
+    if os.path.commonpath([root, os.path.abspath(path)]) != root:
+        return None
+    name = os.path.basename(path)
+    digest = name.split(".", 1)[0].split("_", 1)[0]
+    return digest if len(digest) == 64 else None
+
+
+def store_blob(data: bytes, ext: str) -> Tuple[str, str]:
+    """
+    Store bytes under their content hash; returns (digest, path).
+    If the blob already exists nothing is written (just its mtime bumped,
+    so the GC grace period starts over).
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(digest, ext)
+    if os.path.exists(path):
+        os.utime(path)
+        return digest, path
+
+    folder = blob_dir(digest)
+    os.makedirs(folder, exist_ok=True)
+    # Write to a temp file in the same dir, then rename: readers never see
+    # a half-written blob, and concurrent writers of the same bytes are fine
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest, path
+
+
+def iter_blob_files() -> Iterator[Tuple[str, str]]:
+    """Yield (digest, path) for every file in the blob store."""
+    root = _blob_root()
+    if not os.path.isdir(root):
+        return
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            if name.startswith(".tmp-"):
+                continue
+            path = os.path.join(dirpath, name)
+            digest = blob_digest_from_path(path)
+            if digest:
+                yield digest, path
+
+
+def delete_blob_files(digest: str) -> int:
+    """Remove a blob and all of its variants. Returns number of files removed."""
+    folder = blob_dir(digest)
+    removed = 0
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        if name.startswith(digest):
+            try:
+                os.remove(os.path.join(folder, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def _sniff_image_ext(head: bytes) -> Optional[str]:
+    for signature, ext in _IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def _upload_size(file) -> Optional[int]:
+    size = getattr(file, "size", None)
+    return size if isinstance(size, int) else None
+
+
+def check_upload_sizes(files, max_total: int = MAX_REQUEST_UPLOAD_BYTES):
+    """
+    Reject a batch of uploads before reading any of them: every file must
+    be within MAX_UPLOAD_BYTES and the batch within max_total.
+    """
+    total = 0
+    for file in files:
+        size = _upload_size(file)
+        if size is None:
+            continue
+        if size > MAX_UPLOAD_BYTES:
+            raise UploadRejected(
+                f"{file.name} is too large ({size // (1024 * 1024)} MB). "
+                f"Max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB per photo."
+            )
+        total += size
+    if total > max_total:
+        raise UploadRejected(
+            f"Photos are too large in total ({total // (1024 * 1024)} MB). "
+            f"Max {max_total // (1024 * 1024)} MB per listing."
+        )
+
+
+def store_upload(file, max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[str, str]:
+    """
+    Stream a file-like upload into the blob store in UPLOAD_CHUNK_SIZE
+    chunks; returns (digest, path).
+
+    In the same single pass we hash the bytes, check the magic bytes (the
+    extension comes from the content, not the client's file name) and
+    enforce max_bytes. Data goes to a temp file in the blob root that is
+    atomically renamed into place, or removed if anything fails.
+    """
+    size = _upload_size(file)
+    if size is not None and size > max_bytes:
+        raise UploadRejected(f"{file.name} is larger than {max_bytes} bytes.")
+
+    root = _blob_root()
+    os.makedirs(root, exist_ok=True)
+    if hasattr(file, "seek"):
+        file.seek(0)
+
+    hasher = hashlib.sha256()
+    written = 0
+    ext = None
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if ext is None:
+                    ext = _sniff_image_ext(chunk[:16])
+                    if ext is None:
+                        raise UploadRejected(
+                            f"{getattr(file, 'name', 'Upload')} is not a JPEG, PNG or WebP image."
+                        )
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadRejected(
+                        f"{getattr(file, 'name', 'Upload')} is larger than {max_bytes} bytes."
+                    )
+                hasher.update(chunk)
+                out.write(chunk)
+
+        if ext is None:
+            raise UploadRejected(f"{getattr(file, 'name', 'Upload')} is empty.")
+
+        digest = hasher.hexdigest()
+        path = blob_path(digest, ext)
+        if os.path.exists(path):
+            # Already stored (dedupe) – keep the existing file
+            os.remove(tmp_path)
+            os.utime(path)
+        else:
+            os.makedirs(blob_dir(digest), exist_ok=True)
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return digest, path
+
+
 def save_listing_image(user_id: int, file) -> str:
-    folder = _ensure_upload_dir("listings")
-    _, ext = os.path.splitext(file.name)
-    ext = ext.lower() or ".jpg"
-    filename = f"listing_{user_id}_{int(time.time())}{ext}"
-    path = os.path.join(folder, filename)
-    with open(path, "wb") as f:
-        f.write(file.getbuffer())
+    """Store an uploaded listing photo in the blob store; returns its path."""
+    _, path = store_upload(file)
     return path
 
 
 def save_profile_image(user_id: int, file) -> str:
-    folder = _ensure_upload_dir("profiles")
-    _, ext = os.path.splitext(file.name)
-    ext = ext.lower() or ".jpg"
-    filename = f"profile_{user_id}_{int(time.time())}{ext}"
-    path = os.path.join(folder, filename)
-    with open(path, "wb") as f:
-        f.write(file.getbuffer())
+    """Store an uploaded profile photo in the blob store; returns its path."""
+    _, path = store_upload(file)
     return path
+
+
+def _save_variant(img, path: str):
+    """
+    Encode a variant to a temp file next to `path`, then rename it into
+    place (like store_blob): a crash or a full disk mid-save never leaves
+    a truncated variant that the exists() shortcut would serve forever,
+    and concurrent writers of the same variant are fine.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            img.save(f, VARIANT_FORMAT, quality=VARIANT_QUALITY, optimize=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def generate_image_variants(path: str) -> Dict[str, str]:
+    """
+    Write resized copies of an uploaded image next to it
+    (photo.jpg -> photo_thumb.webp, photo_card.webp, photo_detail.webp)
+    and return {variant_name: path}. Variants never upscale; returns {}
+    if Pillow isn't available or the file can't be decoded.
+    """
+    if Image is None:
+        return {}
+
+    stem, _ = os.path.splitext(path)
+    variants = {
+        name: f"{stem}_{name}{VARIANT_EXT}" for name in IMAGE_VARIANTS
+    }
+    # Content-addressed originals: a re-upload already has its variants
+    if all(os.path.exists(p) for p in variants.values()):
+        return variants
+
+    try:
+        with Image.open(path) as img:
+            # Respect camera rotation before we throw EXIF away
+            img = ImageOps.exif_transpose(img)
+            if VARIANT_FORMAT == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            elif img.mode not in ("RGB", "RGBA", "L"):
+                img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+            # Largest first, so each smaller variant resizes a smaller image
+            for name, max_edge in sorted(IMAGE_VARIANTS.items(), key=lambda kv: -kv[1]):
+                variant_path = variants[name]
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+                _save_variant(img, variant_path)
+    except IMAGE_DECODE_ERRORS:
+        # Not an image Pillow understands (or will) – keep the original only
+        return {}
+
+    return variants
+
+
+def pick_image_variant(variants: Optional[Dict[str, str]], original: str, width: int) -> str:
+    """
+    Return the smallest stored variant that is at least `width` px wide
+    (the display width), falling back to the largest variant / original.
+    """
+    if not variants:
+        return original
+
+    fitting = [
+        (max_edge, variants[name])
+        for name, max_edge in IMAGE_VARIANTS.items()
+        if name in variants and max_edge >= width
+    ]
+    if fitting:
+        return min(fitting)[1]
+    return original
+
+
+# ---------- Parallel processing for multi-photo listings ----------
+#
+# Decoding, resizing and re-encoding happen inside Pillow's C code, which
+# releases the GIL, so a small thread pool gets real parallelism without
+# copying upload bytes into worker processes.
+
+IMAGE_WORKERS = int(os.getenv("CIRCLE_IMAGE_WORKERS", "4"))
+
+_image_executor: Optional[ThreadPoolExecutor] = None
+_image_executor_lock = threading.Lock()
+
+
+def _get_image_executor() -> ThreadPoolExecutor:
+    """One bounded pool per process, shared by every session."""
+    global _image_executor
+    if _image_executor is None:
+        with _image_executor_lock:
+            if _image_executor is None:
+                _image_executor = ThreadPoolExecutor(
+                    max_workers=IMAGE_WORKERS, thread_name_prefix="image"
+                )
+    return _image_executor
+
+
+class ProcessedImage(NamedTuple):
+    name: str
+    path: Optional[str]
+    variants: Dict[str, str]
+    error: Optional[str]
+
+
+# EXIF Orientation tag; 1 means the pixels are stored upright
+_EXIF_ORIENTATION = 0x0112
+
+
+def strip_exif(path: str) -> str:
+    """
+    Store a copy of an image without its EXIF block (GPS, camera serials,
+    ...), applying the EXIF rotation first, and return the copy's path.
+    Returns `path` itself if there is no EXIF or Pillow is unavailable.
+
+    The copy is a new blob named after its own bytes, so the store stays
+    content-addressed; the unstripped original is referenced by nothing
+    and gc_orphan_blobs removes it after the grace period.
+    """
+    if Image is None:
+        return path
+    with Image.open(path) as img:
+        exif = img.getexif()
+        if not exif:
+            return path
+        fmt = img.format
+        out = io.BytesIO()
+        if exif.get(_EXIF_ORIENTATION, 1) == 1:
+            # Upright already: re-save the decoded image as is. For a JPEG,
+            # reuse its quantization tables – no visible re-compression
+            img.save(out, fmt, **({"quality": "keep"} if fmt == "JPEG" else {}))
+        else:
+            # Rotated pixels have to be re-encoded
+            cleaned = ImageOps.exif_transpose(img)
+            cleaned.save(out, fmt, **({"quality": 95} if fmt == "JPEG" else {}))
+    _, ext = os.path.splitext(path)
+    _, stripped_path = store_blob(out.getvalue(), ext)
+    return stripped_path
+
+
+def _process_one(user_id: int, file) -> ProcessedImage:
+    name = getattr(file, "name", "photo")
+    try:
+        path = save_listing_image(user_id=user_id, file=file)
+        path = strip_exif(path)
+        variants = generate_image_variants(path)
+    except UploadRejected as e:
+        return ProcessedImage(name, None, {}, str(e))
+    except Exception as e:
+        # Anything else Pillow throws at one photo (decompression bombs,
+        # truncated data, ...) is reported for that photo, not raised
+        return ProcessedImage(name, None, {}, f"Could not process {name}: {e}")
+    return ProcessedImage(name, path, variants, None)
+
+
+def process_listing_images(user_id: int, files) -> List[ProcessedImage]:
+    """
+    Store, strip EXIF from and resize every photo of a listing
+    concurrently. Results come back in upload order, one per file; failed
+    photos have path=None and an error message instead of raising, so the
+    caller can report them all at once.
+    """
+    files = list(files)
+    if len(files) <= 1:
+        return [_process_one(user_id, f) for f in files]
+    executor = _get_image_executor()
+    return list(executor.map(lambda f: _process_one(user_id, f), files))
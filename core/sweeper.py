@@ -0,0 +1,198 @@
+# core/sweeper.py
+"""
+Reservation expiry sweeper.
+
+Checkout moves a listing to 'reserved' together with a 'pending' order.
+If the buyer abandons the Stripe page the order never progresses, so this
+worker periodically looks at pending Stripe orders older than a TTL and
+asks Stripe what became of their Checkout session:
+
+  - expired  -> provably unpaid: expire the order and put the listing
+                back on sale (core.db.expire_reservations)
+  - complete + paid -> mark the order 'paid' so it isn't checked again
+  - anything else (still open, lookup failed) -> leave it alone
+
+Orders paid outside Stripe (Zelle, PayPal, ...) are never touched: nothing
+in the app can tell a paid one from an abandoned one. Without the stripe
+package / STRIPE_SECRET_KEY the sweeper doesn't start at all.
+
+Runs as a daemon thread inside the Streamlit process (app.py), or on its
+own:
+
+    python -m core.sweeper           # loop forever
+    python -m core.sweeper --once    # single pass, e.g. from cron
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+from . import db
+from .periodic import PeriodicWorker
+
+# Try to import stripe, but don't crash if it's missing
+try:
+    import stripe  # type: ignore
+except ImportError:
+    stripe = None
+
+log = logging.getLogger(__name__)
+
+# Stripe Checkout sessions stay payable for 24h by default; by then they
+# are either complete or expired
+RESERVATION_TTL_SECONDS = int(os.getenv("CIRCLE_RESERVATION_TTL_SECONDS", str(24 * 3600)))
+SWEEP_INTERVAL_SECONDS = float(os.getenv("CIRCLE_SWEEP_INTERVAL_SECONDS", "300"))
+SWEEP_BATCH_SIZE = int(os.getenv("CIRCLE_SWEEP_BATCH_SIZE", "200"))
+
+# What a Checkout session tells us about its order
+SESSION_EXPIRED = "expired"
+SESSION_PAID = "paid"
+
+
+def stripe_session_outcome(session_id: str, api_key: Optional[str] = None) -> Optional[str]:
+    """SESSION_EXPIRED, SESSION_PAID, or None if it's neither (yet)."""
+    session = stripe.checkout.Session.retrieve(
+        session_id, api_key=api_key or os.getenv("STRIPE_SECRET_KEY")
+    )
+    if session.status == "expired":
+        return SESSION_EXPIRED
+    if session.status == "complete" and session.payment_status == "paid":
+        return SESSION_PAID
+    return None
+
+
+class ReservationSweeper(PeriodicWorker):
+    """Daemon thread that calls expire_stale_reservations on an interval."""
+
+    name = "reservation-sweeper"
+
+    def __init__(
+        self,
+        ttl_seconds: int = RESERVATION_TTL_SECONDS,
+        interval_seconds: float = SWEEP_INTERVAL_SECONDS,
+        batch_size: int = SWEEP_BATCH_SIZE,
+        session_outcome: Callable[[str], Optional[str]] = stripe_session_outcome,
+    ):
+        super().__init__(interval_seconds)
+        self.ttl_seconds = ttl_seconds
+        self.batch_size = batch_size
+        self.session_outcome = session_outcome
+        self.runs = 0
+        self.orders_expired = 0
+        self.orders_paid = 0
+        self.listings_released = 0
+        self.last_result: Optional[dict] = None
+
+    def _outcome(self, order) -> Optional[str]:
+        try:
+            return self.session_outcome(order["stripe_session_id"])
+        except Exception as e:
+            # Unknown session, Stripe down, ...: not provably unpaid
+            log.warning("Could not check Stripe session for order %s: %s", order["id"], e)
+            return None
+
+    def run_once(self) -> dict:
+        started = time.monotonic()
+        result = {"checked": 0, "orders": 0, "paid": 0, "listings": 0}
+        after = None
+        while True:
+            orders = db.get_stale_stripe_reservations(self.ttl_seconds, self.batch_size, after)
+            expired_ids = []
+            for order in orders:
+                result["checked"] += 1
+                outcome = self._outcome(order)
+                if outcome == SESSION_EXPIRED:
+                    expired_ids.append(order["id"])
+                elif outcome == SESSION_PAID:
+                    db.update_order_status(order["id"], "paid")
+                    result["paid"] += 1
+            if expired_ids:
+                released = db.expire_reservations(expired_ids)
+                result["orders"] += released["orders"]
+                result["listings"] += released["listings"]
+            if len(orders) < self.batch_size:
+                break
+            after = (orders[-1]["created_at"], orders[-1]["id"])
+
+        result["seconds"] = round(time.monotonic() - started, 4)
+        self.runs += 1
+        self.orders_expired += result["orders"]
+        self.orders_paid += result["paid"]
+        self.listings_released += result["listings"]
+        self.last_result = result
+        if result["orders"] or result["paid"]:
+            log.info(
+                "Expired %d unpaid reservations (released %d listings), %d paid",
+                result["orders"],
+                result["listings"],
+                result["paid"],
+            )
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "errors": self.errors,
+            "orders_expired": self.orders_expired,
+            "orders_paid": self.orders_paid,
+            "listings_released": self.listings_released,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+_sweeper: Optional[ReservationSweeper] = None
+_sweeper_lock = threading.Lock()
+
+
+def stripe_configured() -> bool:
+    return stripe is not None and bool(os.getenv("STRIPE_SECRET_KEY"))
+
+
+def start_reservation_sweeper(**kwargs) -> Optional[ReservationSweeper]:
+    """
+    Start (once per process) and return the reservation sweeper, or None
+    if Stripe isn't configured (then nothing can be proven unpaid).
+    """
+    global _sweeper
+    if "session_outcome" not in kwargs and not stripe_configured():
+        log.info("Stripe is not configured; reservation sweeper not started.")
+        return None
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = ReservationSweeper(**kwargs)
+        _sweeper.start()
+    return _sweeper
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Expire abandoned (unpaid) Stripe checkout reservations.")
+    parser.add_argument("--once", action="store_true", help="run a single sweep and exit")
+    parser.add_argument("--ttl", type=int, default=RESERVATION_TTL_SECONDS)
+    parser.add_argument("--interval", type=float, default=SWEEP_INTERVAL_SECONDS)
+    parser.add_argument("--batch-size", type=int, default=SWEEP_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if not stripe_configured():
+        parser.exit(1, "Stripe is not configured (stripe package / STRIPE_SECRET_KEY).\n")
+    db.ensure_schema()
+    sweeper = ReservationSweeper(args.ttl, args.interval, args.batch_size)
+
+    if args.once:
+        print(sweeper.run_once())
+        return
+
+    sweeper.run_once()
+    sweeper.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sweeper.stop()
+
+
+if __name__ == "__main__":
+    main()
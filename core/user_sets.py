@@ -0,0 +1,183 @@
+# core/user_sets.py
+"""
+Cart and likes for the Streamlit pages.
+
+PersistentIdSet is an insertion-ordered, set-backed mirror of a user's
+cart_items / likes rows: membership tests and toggles are O(1), and
+changes are written back to core.db in batches (one transaction) rather
+than once per click. A background flusher writes whatever is pending every
+FLUSH_INTERVAL_SECONDS, so a change is saved even if the user closes the
+tab right after clicking (no later rerun needed). Every so often the
+mirror re-reads the DB so a cart filled on another device shows up here
+too.
+
+Pages get the per-session instance via session_id_set("cart" | "likes", user_id).
+"""
+import os
+import threading
+import time
+
+import streamlit as st
+
+from . import db
+from .periodic import PeriodicWorker
+
+# Write pending changes once this many have piled up (checked on each
+# rerun), and in any case within about this long (background flusher)
+FLUSH_BATCH_SIZE = int(os.getenv("CIRCLE_USER_SET_FLUSH_BATCH", "20"))
+FLUSH_INTERVAL_SECONDS = float(os.getenv("CIRCLE_USER_SET_FLUSH_SECONDS", "2"))
+
+# Re-read from the DB (cross-device changes) at most this often
+SYNC_INTERVAL_SECONDS = float(os.getenv("CIRCLE_USER_SET_SYNC_SECONDS", "30"))
+
+
+class PersistentIdSet:
+    def __init__(self, kind: str, user_id: int):
+        self.kind = kind
+        self.user_id = user_id
+        self._ids = {}  # dict as an ordered set
+        self._added = set()
+        self._removed = set()
+        self._dirty_since = None
+        self._synced_at = 0.0
+        # The script thread mutates, the background flusher writes
+        self._lock = threading.RLock()
+        self.sync()
+
+    # ---- set protocol ----
+
+    def __contains__(self, listing_id) -> bool:
+        return listing_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(list(self._ids))
+
+    def add(self, listing_id):
+        with self._lock:
+            if listing_id in self._ids:
+                return
+            self._ids[listing_id] = None
+            if listing_id in self._removed:
+                self._removed.discard(listing_id)
+            else:
+                self._added.add(listing_id)
+            self._mark_dirty()
+
+    def discard(self, listing_id):
+        with self._lock:
+            if listing_id not in self._ids:
+                return
+            del self._ids[listing_id]
+            if listing_id in self._added:
+                self._added.discard(listing_id)
+            else:
+                self._removed.add(listing_id)
+            self._mark_dirty()
+
+    def toggle(self, listing_id) -> bool:
+        """Add or remove; returns True if the id is now in the set."""
+        if listing_id in self._ids:
+            self.discard(listing_id)
+            return False
+        self.add(listing_id)
+        return True
+
+    # ---- persistence ----
+
+    def _mark_dirty(self):
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
+            _schedule_flush(self)
+
+    @property
+    def pending(self) -> int:
+        return len(self._added) + len(self._removed)
+
+    def flush(self):
+        """Write pending adds/removes to the DB in one transaction."""
+        with self._lock:
+            if not self.pending:
+                return
+            db.save_user_set_changes(
+                self.kind, self.user_id, added=list(self._added), removed=list(self._removed)
+            )
+            self._added.clear()
+            self._removed.clear()
+            self._dirty_since = None
+
+    def sync(self):
+        """Flush, then reload from the DB (picks up other devices' changes)."""
+        with self._lock:
+            self.flush()
+            self._ids = dict.fromkeys(db.get_user_set_ids(self.kind, self.user_id))
+            self._synced_at = time.monotonic()
+
+    def maintain(self):
+        """Flush / sync if due. Called once per script run by session_id_set."""
+        now = time.monotonic()
+        if self.pending >= FLUSH_BATCH_SIZE:
+            self.flush()
+        if now - self._synced_at >= SYNC_INTERVAL_SECONDS:
+            self.sync()
+
+
+# ---------- BACKGROUND FLUSH ----------
+#
+# Sets with unsaved changes register here; the flusher thread writes them
+# out every FLUSH_INTERVAL_SECONDS. Strong references on purpose: a set
+# whose session has just ended still gets its last changes written.
+
+_dirty_sets = set()
+_dirty_lock = threading.Lock()
+
+
+class _PendingFlusher(PeriodicWorker):
+    name = "user-set-flusher"
+
+    def run_once(self) -> int:
+        with _dirty_lock:
+            dirty = list(_dirty_sets)
+            _dirty_sets.clear()
+        flushed = 0
+        error = None
+        for id_set in dirty:
+            try:
+                id_set.flush()
+                flushed += 1
+            except Exception as e:
+                # Keep it queued for the next pass; report after the rest
+                with _dirty_lock:
+                    _dirty_sets.add(id_set)
+                error = e
+        if error is not None:
+            raise error
+        return flushed
+
+
+_flusher = None
+
+
+def _schedule_flush(id_set: PersistentIdSet):
+    global _flusher
+    with _dirty_lock:
+        _dirty_sets.add(id_set)
+        if _flusher is None:
+            _flusher = _PendingFlusher(FLUSH_INTERVAL_SECONDS)
+        _flusher.start()
+
+
+def session_id_set(kind: str, user_id: int) -> PersistentIdSet:
+    """This session's cart / likes mirror for user_id (re-created on user switch)."""
+    key = f"{kind}_id_set"
+    id_set = st.session_state.get(key)
+    if id_set is None or id_set.user_id != user_id:
+        if id_set is not None:
+            id_set.flush()
+        id_set = PersistentIdSet(kind, user_id)
+        st.session_state[key] = id_set
+    else:
+        id_set.maintain()
+    return id_set
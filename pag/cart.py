@@ -1,49 +1,21 @@
 # pag/cart.py
-import json
 import streamlit as st
 from core.db import get_listings_by_ids
-
-
-def _format_meta(row):
-    bits = []
-    if row["brand"]:
-        bits.append(str(row["brand"]))
-    if row["category"]:
-        bits.append(str(row["category"]))
-    if row["condition"]:
-        bits.append(str(row["condition"]))
-    return " · ".join(bits) if bits else None
-
-
-def _get_image_list(row):
-    paths = []
-    if row["image_paths"]:
-        try:
-            loaded = json.loads(row["image_paths"])
-            if isinstance(loaded, list):
-                paths = [p for p in loaded if p]
-        except Exception:
-            paths = []
-
-    if not paths and row["image_path"]:
-        paths = [row["image_path"]]
-
-    return paths
+from core.user_sets import session_id_set
 
 
 def render(user):
     st.header("My Cart")
 
-    if "cart_listing_ids" not in st.session_state:
-        st.session_state["cart_listing_ids"] = []
+    cart = session_id_set("cart", user["id"])
+    # Save pending clicks and pick up items added on other devices
+    cart.sync()
 
-    cart_ids = st.session_state["cart_listing_ids"]
-
-    if not cart_ids:
+    if not cart:
         st.info("Your cart is empty. Add items from the Home page to see them here. 🛒")
         return
 
-    unique_ids = list(dict.fromkeys(cart_ids))
+    unique_ids = list(cart)
     rows = get_listings_by_ids(unique_ids)
     if not rows:
         st.info("No valid items found for your cart yet.")
@@ -54,43 +26,37 @@ def render(user):
     subtotal = 0.0
 
     for row in rows:
-        price = float(row["price"])
-        subtotal += price
-
-        listing_id = row["id"]
-        image_paths = _get_image_list(row)
+        subtotal += row.price
+        listing_id = row.id
 
         with st.container(border=True):
             col_img, col_text = st.columns([1, 2])
 
             with col_img:
-                if image_paths:
+                if row.images:
                     try:
-                        st.image(image_paths[0], width=200)
+                        st.image(row.image(0, width=200), width=200)
                     except Exception:
                         st.caption("Image not available.")
                 else:
                     st.caption("No image")
 
             with col_text:
-                st.markdown(f"**{row['title']}** – ${price:.0f}")
+                st.markdown(f"**{row.title}** – {row.price_label}")
 
-                meta = _format_meta(row)
-                if meta:
-                    st.caption(meta)
+                if row.meta:
+                    st.caption(row.meta)
 
-                if row["retail_price"] is not None:
-                    st.caption(f"Original retail: ${float(row['retail_price']):.0f}")
+                if row.retail_label:
+                    st.caption(f"Original retail: {row.retail_label}")
 
-                st.write(row["description"])
+                st.write(row.description)
 
-                seller = row["seller_name"] if row["seller_name"] else "Unknown"
-                st.caption(f"Seller: {seller}")
+                st.caption(f"Seller: {row.seller_name}")
 
                 if st.button("Remove from cart", key=f"remove_cart_{listing_id}"):
-                    st.session_state["cart_listing_ids"] = [
-                        x for x in st.session_state["cart_listing_ids"] if x != listing_id
-                    ]
+                    cart.discard(listing_id)
+                    cart.flush()
                     st.rerun()
 
     st.divider()
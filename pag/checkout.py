@@ -1,15 +1,15 @@
 
 # pag/checkout.py
-import json
 import streamlit as st
 
 from core.db import (
     get_listings_by_ids,
     get_user_by_id,
-    create_order,
-    update_listing_status,
+    reserve_and_create_order,
+    CheckoutBusy,
     update_order_stripe_info,
 )
+from core.user_sets import session_id_set
 
 # Try to import stripe, but don't crash the whole app if it's missing
 try:
@@ -33,22 +33,6 @@ CA_PROVINCES = [
 ]
 
 
-def _get_image_list(row):
-    paths = []
-    if row["image_paths"]:
-        try:
-            loaded = json.loads(row["image_paths"])
-            if isinstance(loaded, list):
-                paths = [p for p in loaded if p]
-        except Exception:
-            paths = []
-
-    if not paths and row["image_path"]:
-        paths = [row["image_path"]]
-
-    return paths
-
-
 def render(user):
     st.header("Checkout")
 
@@ -65,39 +49,31 @@ def render(user):
 
     listing = rows[0]
     seller_id = listing["user_id"]
-    price = float(listing["price"])
+    price = listing.price
 
     # ---------- ITEM SUMMARY ----------
     st.subheader("Item you are purchasing")
 
     col_img, col_txt = st.columns([1, 2])
     with col_img:
-        images = _get_image_list(listing)
-        if images:
+        if listing.images:
             try:
-                st.image(images[0], width=220)
+                st.image(listing.image(0, width=220), width=220)
             except Exception:
                 st.caption("Image not available.")
         else:
             st.caption("No image")
 
     with col_txt:
-        st.markdown(f"**{listing['title']}** – ${price:.0f}")
+        st.markdown(f"**{listing.title}** – {listing.price_label}")
 
-        meta_bits = []
-        if listing["brand"]:
-            meta_bits.append(str(listing["brand"]))
-        if listing["category"]:
-            meta_bits.append(str(listing["category"]))
-        if listing["condition"]:
-            meta_bits.append(str(listing["condition"]))
-        if meta_bits:
-            st.caption(" · ".join(meta_bits))
+        if listing.meta:
+            st.caption(listing.meta)
 
-        if listing["retail_price"] is not None:
-            st.caption(f"Original retail: ${float(listing['retail_price']):.0f}")
+        if listing.retail_label:
+            st.caption(f"Original retail: {listing.retail_label}")
 
-        st.write(listing["description"])
+        st.write(listing.description)
 
     st.divider()
 
@@ -192,32 +168,41 @@ def render(user):
     # ---------- CREATE ORDER (local DB) ----------
     buyer_id = user["id"]
     total_price = price  # TODO: later add shipping / fees if needed
+    cart = session_id_set("cart", buyer_id)
 
-    order_id = create_order(
-        buyer_id=buyer_id,
-        seller_id=seller_id,
-        listing_id=listing_id,
-        total_price=total_price,
-        shipping_name=full_name.strip(),
-        shipping_address1=address1.strip(),
-        shipping_address2=address2.strip(),
-        shipping_city=city.strip(),
-        shipping_state=state.strip(),
-        shipping_postal_code=postal_code_clean,
-        shipping_country=country,
-        shipping_phone=formatted_phone,
-        payment_method=payment_method,  # now we store selected method
-        buyer_note=buyer_note.strip(),
-    )
-
-    # Mark listing as reserved so it disappears from public feed
-    update_listing_status(seller_id, listing_id, "reserved")
+    # Reserve the listing and create the order in one transaction, so two
+    # buyers can never both get it
+    try:
+        order_id = reserve_and_create_order(
+            buyer_id=buyer_id,
+            seller_id=seller_id,
+            listing_id=listing_id,
+            total_price=total_price,
+            shipping_name=full_name.strip(),
+            shipping_address1=address1.strip(),
+            shipping_address2=address2.strip(),
+            shipping_city=city.strip(),
+            shipping_state=state.strip(),
+            shipping_postal_code=postal_code_clean,
+            shipping_country=country,
+            shipping_phone=formatted_phone,
+            payment_method=payment_method,  # now we store selected method
+            buyer_note=buyer_note.strip(),
+        )
+    except CheckoutBusy:
+        st.warning("Checkout is very busy right now – please try again in a moment.")
+        return
+
+    if order_id is None:
+        st.error("Sorry, this item was just reserved by another buyer.")
+        cart.discard(listing_id)
+        cart.flush()
+        st.session_state["checkout_listing_id"] = None
+        return
 
     # Remove from cart
-    if "cart_listing_ids" in st.session_state:
-        st.session_state["cart_listing_ids"] = [
-            x for x in st.session_state["cart_listing_ids"] if x != listing_id
-        ]
+    cart.discard(listing_id)
+    cart.flush()
 
     # Clear checkout selection
     st.session_state["checkout_listing_id"] = None
@@ -1,7 +1,11 @@
 # pag/create_listing.py
 import streamlit as st
 from core.db import insert_listing
-from core.storage import save_listing_image
+from core.storage import (
+    UploadRejected,
+    check_upload_sizes,
+    process_listing_images,
+)
 
 
 CATEGORIES = [
@@ -135,17 +139,28 @@ def render(user):
     else:
         final_condition = condition
 
+    photos = (uploaded_files or [])[:7]
+    try:
+        check_upload_sizes(photos)
+    except UploadRejected as e:
+        errors.append(str(e))
+
     if errors:
         for e in errors:
             st.error(e)
         return
 
-    # Save images (limit to 7)
-    image_paths = []
-    if uploaded_files:
-        for f in uploaded_files[:7]:
-            path = save_listing_image(user_id=user["id"], file=f)
-            image_paths.append(path)
+    # Save images (limit to 7) + resized copies for the feed/cart/checkout,
+    # all photos in parallel
+    results = process_listing_images(user["id"], photos)
+    failed = [r for r in results if r.error]
+    if failed:
+        for r in failed:
+            st.error(r.error)
+        return
+
+    image_paths = [r.path for r in results]
+    image_variants = [r.variants for r in results]
 
     # If retail price is 0, store it as None so DB isn't cluttered
     retail_value = retail_price if retail_price > 0 else None
@@ -161,6 +176,7 @@ def render(user):
         retail_price=retail_value,
         image_paths=image_paths,
         status=status,
+        image_variants=image_variants,
     )
 
     if status == "published":
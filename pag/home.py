@@ -1,69 +1,36 @@
 # pag/home.py
-import json
 import streamlit as st
-from core.db import get_all_listings, get_friend_listings
-
-
-def _format_meta(row):
-    bits = []
-    if row["brand"]:
-        bits.append(str(row["brand"]))
-    if row["category"]:
-        bits.append(str(row["category"]))
-    if row["condition"]:
-        bits.append(str(row["condition"]))
-    return " · ".join(bits) if bits else None
-
-
-def _get_image_list(row):
-    """Return a list of image paths for this listing."""
-    paths = []
-
-    if row["image_paths"]:
-        try:
-            loaded = json.loads(row["image_paths"])
-            if isinstance(loaded, list):
-                paths = [p for p in loaded if p]
-        except Exception:
-            paths = []
-
-    # Fallback to single image_path if needed
-    if not paths and row["image_path"]:
-        paths = [row["image_path"]]
-
-    return paths
-
-def _listing_card(row, user, prefix: str):
-    listing_id = row["id"]
+from core.db import (
+    get_listings_page,
+    get_popular_listings_page,
+    get_friend_listings_page,
+    search_listings,
+)
+from core.user_sets import session_id_set
+
+
+def _listing_card(row, user, cart, likes, prefix: str):
+    """row is a core.listing_view.ListingView; cart/likes are PersistentIdSets."""
+    listing_id = row.id
     img_key = f"{prefix}_img_idx_{listing_id}"
 
     # Initialize carousel index
     if img_key not in st.session_state:
         st.session_state[img_key] = 0
 
-    image_paths = _get_image_list(row)
-    num_images = len(image_paths)
-
-    # Initialize cart and likes in session
-    if "cart_listing_ids" not in st.session_state:
-        st.session_state["cart_listing_ids"] = []
-    if "liked_listing_ids" not in st.session_state:
-        st.session_state["liked_listing_ids"] = []
+    num_images = len(row.images)
 
-    cart_ids = st.session_state["cart_listing_ids"]
-    liked_ids = st.session_state["liked_listing_ids"]
-
-    in_cart = listing_id in cart_ids
-    liked = listing_id in liked_ids
+    in_cart = listing_id in cart
+    liked = listing_id in likes
 
     with st.container(border=True):
         col_img, col_text = st.columns([1, 2])
 
         # ------- IMAGE + CAROUSEL -------
         with col_img:
-            if image_paths:
+            if num_images:
                 idx = st.session_state[img_key] % num_images
-                current_path = image_paths[idx]
+                current_path = row.image(idx, width=220)
 
                 try:
                     st.image(current_path, width=220)
@@ -87,19 +54,19 @@ def _listing_card(row, user, prefix: str):
 
         # ------- TEXT + META + ACTIONS -------
         with col_text:
-            st.markdown(f"**{row['title']}** – ${float(row['price']):.0f}")
+            st.markdown(f"**{row.title}** – {row.price_label}")
 
-            meta = _format_meta(row)
-            if meta:
-                st.caption(meta)
+            if row.meta:
+                st.caption(row.meta)
 
-            if row["retail_price"] is not None:
-                st.caption(f"Original retail: ${float(row['retail_price']):.0f}")
+            if row.retail_label:
+                st.caption(f"Original retail: {row.retail_label}")
 
-            st.write(row["description"])
+            st.write(row.description)
 
-            seller = row["seller_name"] if row["seller_name"] else "Unknown"
-            st.caption(f"Seller: {seller} • Created: {row['created_at']}")
+            st.caption(f"Seller: {row.seller_name} • Created: {row.created_at}")
+            if row.like_count:
+                st.caption(f"❤️ {row.like_count} like{'s' if row.like_count != 1 else ''}")
 
             # --- ACTIONS: LIKE + ADD TO CART ---
             col_like, col_cart = st.columns(2)
@@ -107,23 +74,13 @@ def _listing_card(row, user, prefix: str):
             with col_like:
                 like_label = "❤️ Liked" if liked else "🤍 Like"
                 if st.button(like_label, key=f"{prefix}_like_{listing_id}"):
-                    if liked:
-                        st.session_state["liked_listing_ids"] = [
-                            x for x in liked_ids if x != listing_id
-                        ]
-                    else:
-                        st.session_state["liked_listing_ids"] = liked_ids + [listing_id]
+                    likes.toggle(listing_id)
                     st.rerun()
 
             with col_cart:
                 cart_label = "Remove from cart" if in_cart else "Add to cart"
                 if st.button(cart_label, key=f"{prefix}_cart_{listing_id}"):
-                    if in_cart:
-                        st.session_state["cart_listing_ids"] = [
-                            x for x in cart_ids if x != listing_id
-                        ]
-                    else:
-                        st.session_state["cart_listing_ids"] = cart_ids + [listing_id]
+                    cart.toggle(listing_id)
                     st.rerun()
                 # ⭐ New feature: quick checkout button
                 if in_cart:
@@ -133,103 +90,34 @@ def _listing_card(row, user, prefix: str):
 
 
 # -----------------------
-# Search Helper Function
+# Feed paging ("Load more")
 # -----------------------
-def _matches_query(row, query: str) -> bool:
+def _load_feed(prefix: str, fetch_page):
     """
-    Return True if the listing row matches the search query
-    on title, brand, category, condition, description, or seller name.
-    Works with sqlite3.Row objects.
+    Walk a keyset-paginated feed for as many pages as the user has asked
+    for via "Load more". Returns (rows, has_more).
+    fetch_page(cursor) -> (rows, next_cursor)
     """
-    if not query:
-        return True
-
-    q = query.lower()
-    # the keys we want to search on
-    keys = ["title", "brand", "category", "condition", "description", "seller_name"]
-
-    for key in keys:
-        try:
-            val = row[key]
-        except KeyError:
-            val = None
-
-        if val and q in str(val).lower():
-            return True
-
-    return False
-
-
-        # ---------- IMAGE + CAROUSEL ----------
-    with col_img:
-        if image_paths:
-            idx = st.session_state[img_key] % num_images
-            current_path = image_paths[idx]
-
-            try:
-                st.image(current_path, width=220)
-            except Exception:
-                st.caption("Image not available.")
-
-            if num_images > 1:
-                c1, c2, c3 = st.columns([1, 1, 1])
-                with c1:
-                    if st.button("◀", key=f"{prefix}_prev_{listing_id}"):
-                        st.session_state[img_key] = (idx - 1) % num_images
-                        st.rerun()
-
-                with c2:
-                    st.caption(f"{idx + 1} / {num_images}")
-                with c3:
-                    if st.button("▶", key=f"{prefix}_next_{listing_id}"):
-                        st.session_state[img_key] = (idx + 1) % num_images
-                        st.rerun()
-
-        else:
-            st.caption("No image")
+    pages = st.session_state.setdefault("home_feed_pages", {}).get(prefix, 1)
 
-        # ---------- TEXT + META + ACTIONS ----------
-        with col_text:
-            st.markdown(f"**{row['title']}** – ${float(row['price']):.0f}")
-
-            meta = _format_meta(row)
-            if meta:
-                st.caption(meta)
-
-            if row["retail_price"] is not None:
-                st.caption(f"Original retail: ${float(row['retail_price']):.0f}")
-
-            st.write(row["description"])
-
-            seller = row["seller_name"] if row["seller_name"] else "Unknown"
-            st.caption(f"Seller: {seller} • Created: {row['created_at']}")
-
-            # --- ACTIONS: LIKE + ADD TO CART ---
-            col_like, col_cart = st.columns(2)
-
-            with col_like:
-                like_label = "❤️ Liked" if liked else "🤍 Like"
-                if st.button(like_label, key=f"{prefix}_like_{listing_id}"):
-                    if liked:
-                        st.session_state["liked_listing_ids"] = [
-                            x for x in liked_ids if x != listing_id
-                        ]
-                    else:
-                        st.session_state["liked_listing_ids"] = liked_ids + [listing_id]
-                    st.rerun()
+    rows = []
+    cursor = None
+    for _ in range(pages):
+        page, cursor = fetch_page(cursor)
+        rows.extend(page)
+        if cursor is None:
+            break
 
+    return rows, cursor is not None
 
-            with col_cart:
-                cart_label = "Remove from cart" if in_cart else "Add to cart"
-                if st.button(cart_label, key=f"{prefix}_cart_{listing_id}"):
-                    if in_cart:
-                        st.session_state["cart_listing_ids"] = [
-                            x for x in cart_ids if x != listing_id
-                        ]
-                    else:
-                        st.session_state["cart_listing_ids"] = cart_ids + [listing_id]
-                    st.rerun()
 
+def _load_more_button(prefix: str, has_more: bool):
+    if not has_more:
+        return
+    if st.button("Load more", key=f"{prefix}_load_more"):
+        feed_pages = st.session_state.setdefault("home_feed_pages", {})
+        feed_pages[prefix] = feed_pages.get(prefix, 1) + 1
+        st.rerun()
 
 
 def render(user):
@@ -240,19 +128,17 @@ def render(user):
     with cols[0]:
         st.markdown(f"Logged in as: **{user.get('email', 'unknown')}**")
 
-    # Ensure session state keys exist
-    if "cart_listing_ids" not in st.session_state:
-        st.session_state["cart_listing_ids"] = []
-    if "liked_listing_ids" not in st.session_state:
-        st.session_state["liked_listing_ids"] = []
+    # Server-side cart / likes, mirrored in this session
+    cart = session_id_set("cart", user["id"])
+    likes = session_id_set("likes", user["id"])
 
     with cols[1]:
-        cart_count = len(st.session_state["cart_listing_ids"])
-        like_count = len(st.session_state["liked_listing_ids"])
-        st.caption(f"🛒 Cart: {cart_count} • ❤️ Liked: {like_count}")
+        st.caption(f"🛒 Cart: {len(cart)} • ❤️ Liked: {len(likes)}")
 
     with cols[2]:
         if st.button("Log out / switch user"):
+            cart.flush()
+            likes.flush()
             if "user" in st.session_state:
                 del st.session_state["user"]
             st.rerun()
@@ -267,41 +153,58 @@ def render(user):
 
     st.divider()
 
+    query = search_query.strip()
 
-  
-       # ---- Friends' Listings ----
-    st.subheader("Friends' Listings")
-    friend_listings = get_friend_listings(user["id"])
+    sort = "Newest"
+    if not query:
+        sort = st.radio(
+            "Sort marketplace by", ["Newest", "Popular"], horizontal=True, key="home_sort"
+        )
+
+    # New search / sort => start every feed again from its first page
+    if st.session_state.get("home_feed_query") != (query, sort):
+        st.session_state["home_feed_query"] = (query, sort)
+        st.session_state["home_feed_pages"] = {}
+
+    # With a query, both sections come from the full-text index (best match
+    # first); without one they are the newest-first feeds.
+    if query:
+        def fetch_friend(cursor):
+            return search_listings(query, {"friends_of": user["id"]}, cursor=cursor)
+
+        def fetch_all(cursor):
+            return search_listings(query, cursor=cursor)
+    else:
+        def fetch_friend(cursor):
+            return get_friend_listings_page(user["id"], cursor=cursor)
 
-    if search_query.strip():
-        friend_listings = [
-            row for row in friend_listings
-            if _matches_query(row, search_query)
-        ]
+        def fetch_all(cursor):
+            if sort == "Popular":
+                return get_popular_listings_page(cursor=cursor)
+            return get_listings_page(cursor=cursor)
+
+    # ---- Friends' Listings ----
+    st.subheader("Friends' Listings")
+    friend_listings, friend_more = _load_feed("friend", fetch_friend)
 
     if not friend_listings:
         st.info("No listings from friends match your search yet.")
     else:
         for row in friend_listings:
-            _listing_card(row, user, prefix="friend")
+            _listing_card(row, user, cart, likes, prefix="friend")
+        _load_more_button("friend", friend_more)
 
     # ---- All Marketplace Listings ----
-        # ---- All Marketplace Listings ----
     st.subheader("All Marketplace Listings")
-    all_listings = get_all_listings()
-
-    if search_query.strip():
-        all_listings = [
-            row for row in all_listings
-            if _matches_query(row, search_query)
-        ]
+    all_listings, all_more = _load_feed("all", fetch_all)
 
     if not all_listings:
-        if search_query.strip():
+        if query:
             st.info("No marketplace listings match your search yet.")
         else:
             st.info("No listings in the marketplace yet. Be the first to create one! ✨")
         return
 
     for row in all_listings:
-        _listing_card(row, user, prefix="all")
+        _listing_card(row, user, cart, likes, prefix="all")
+    _load_more_button("all", all_more)
@@ -24,32 +24,25 @@ def render(user):
             col_img, col_text = st.columns([1, 2])
 
             with col_img:
-                if row["image_path"]:
+                if row.images:
                     try:
-                        st.image(row["image_path"], width=220)
+                        st.image(row.image(0, width=220), width=220)
                     except Exception:
                         st.caption("Image not available.")
                 else:
                     st.caption("No image")
 
             with col_text:
-                st.markdown(f"**{row['title']}** – ${row['price']:.0f} &nbsp;&nbsp; _{status_label}_")
-
-                meta_bits = []
-                if row["brand"]:
-                    meta_bits.append(str(row["brand"]))
-                if row["category"]:
-                    meta_bits.append(str(row["category"]))
-                if row["condition"]:
-                    meta_bits.append(str(row["condition"]))
-                if meta_bits:
-                    st.caption(" · ".join(meta_bits))
-
-                if row["retail_price"]:
-                    st.caption(f"Original retail: ${row['retail_price']:.0f}")
-
-                st.write(row["description"])
-                st.caption(f"Created: {row['created_at']} (Listing ID: {row['id']})")
+                st.markdown(f"**{row.title}** – {row.price_label} &nbsp;&nbsp; _{status_label}_")
+
+                if row.meta:
+                    st.caption(row.meta)
+
+                if row.retail_label:
+                    st.caption(f"Original retail: {row.retail_label}")
+
+                st.write(row.description)
+                st.caption(f"Created: {row.created_at} (Listing ID: {row.id})")
 
                 # --- Actions ---
                 col1, col2, col3 = st.columns(3)